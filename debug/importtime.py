@@ -0,0 +1,79 @@
+"""
+Plugin import time benchmark:
+Reports how much time importing the GeoCat Bridge plugin module (which QGIS does at startup) takes,
+and which heavy dependencies are (not) loaded at that point.
+
+Run this script with the Python interpreter of the QGIS installation (e.g. from the OSGeo4W shell):
+
+    python debug/importtime.py [--repeat 5] [--top 15]
+
+The script starts a fresh interpreter for each run (using `python -X importtime`), so that
+cached modules do not influence the results.
+"""
+
+from pathlib import Path
+import argparse
+import statistics
+import subprocess
+import sys
+
+# These modules should not be imported when QGIS starts (only when a Bridge UI is opened)
+_HEAVY_MODULES = ("bridgestyle", "lxml", "psycopg2", "osgeo", "requests",
+                  "geocatbridge.publish", "geocatbridge.ui")
+
+# The code that runs in each fresh interpreter: it imports the plugin module, like QGIS does
+_CODE = """
+import sys
+from qgis.core import QgsApplication
+app = QgsApplication([], False)
+app.initQgis()
+import geocatbridge.plugin
+print(",".join(m for m in sys.modules if m.split(".")[0] in {0!r} or m.startswith(("geocatbridge.publish", "geocatbridge.ui"))))
+"""
+
+
+def _runOnce():
+    """ Imports the plugin in a fresh interpreter and returns the -X importtime records and loaded modules. """
+    root = Path(__file__).resolve().parent.parent
+    code = _CODE.format({m.split(".")[0] for m in _HEAVY_MODULES})
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=str(root),
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "Import failed")
+    records = {}
+    for line in proc.stderr.splitlines():
+        # Format: "import time: <self us> | <cumulative us> | <indented module name>"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = (p.strip() for p in line.replace("import time:", "|", 1).split("|"))
+        records[name] = int(self_us), int(cumulative_us)
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return records, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the import time of the GeoCat Bridge plugin")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs (default: 5)")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest plugin modules to list")
+    args = parser.parse_args()
+
+    totals, records, loaded = [], {}, []
+    for _ in range(max(1, args.repeat)):
+        records, loaded = _runOnce()
+        totals.append(records.get("geocatbridge.plugin", (0, 0))[1] / 1000)
+
+    print(f"geocatbridge.plugin import time over {len(totals)} run(s): "
+          f"median {statistics.median(totals):.1f} ms, min {min(totals):.1f} ms, max {max(totals):.1f} ms")
+
+    print("\nSlowest geocatbridge modules (cumulative, last run):")
+    plugin_records = sorted(((c, n) for n, (_, c) in records.items() if n.startswith("geocatbridge")), reverse=True)
+    for cumulative, name in plugin_records[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    print("\nHeavy modules loaded at startup:")
+    heavy = sorted({m for m in loaded if m.startswith(_HEAVY_MODULES)})
+    print("  " + "\n  ".join(heavy) if heavy else "  none")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,6 @@ import sys
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import Qgis
 
-from geocatbridge.ui.errordialog import ErrorDialog
-
 
 def handleError(errors):
 
@@ -32,5 +30,7 @@ def handleError(errors):
               f"#### {pypath_label}\n" \
               f"{md_pypaths}"
 
+    # Imported here, because loading the dialog UI at plugin startup would delay QGIS
+    from geocatbridge.ui.errordialog import ErrorDialog
     dlg = ErrorDialog(html_text, md_text)
     dlg.exec()
@@ -10,12 +10,11 @@ from qgis.PyQt.QtWidgets import QAction
 from qgis.core import QgsProject, QgsApplication
 
 from geocatbridge.errorhandler import handleError
-from geocatbridge.processing.bridgeprovider import BridgeProvider
-from geocatbridge.publish.servers import readServers
-from geocatbridge.ui.bridgedialog import BridgeDialog
-from geocatbridge.ui.multistylerwidget import MultistylerWidget
 from geocatbridge.utils import meta, files
 
+# Note: the publish and UI modules (and their dependencies, like bridgestyle, lxml, psycopg2 and GDAL)
+# are imported when they are first needed, so that they do not add to the QGIS startup time.
+
 
 class GeocatBridge:
     def __init__(self, iface):
@@ -26,11 +25,9 @@ class GeocatBridge:
         self.action_help = None
         self.action_multistyler = None
         self.widget_multistyler = None
-
-        readServers()
+        self._provider = None
 
         self.name = meta.getAppName()
-        self.provider = BridgeProvider()
         self.locale = QSettings().value("locale/userLocale")[0:2]
         locale_path = files.getLocalePath(f"bridge_{self.locale}")
 
@@ -54,6 +51,13 @@ class GeocatBridge:
         
         sys.excepthook = plugin_hook
 
+    @property
+    def provider(self):
+        if self._provider is None:
+            from geocatbridge.processing.bridgeprovider import BridgeProvider
+            self._provider = BridgeProvider()
+        return self._provider
+
     def initGui(self):
         self.action_publish = QAction(QIcon(files.getIconPath("publish_button")),
                                       QCoreApplication.translate(self.name, "Publish"), self._win)
@@ -68,17 +72,13 @@ class GeocatBridge:
         self.action_help.triggered.connect(lambda: webbrowser.open_new(files.getHtmlDocsPath("index")))
         self.iface.addPluginToWebMenu(self.name, self.action_help)
 
-        self.widget_multistyler = MultistylerWidget()
-        self.iface.addDockWidget(Qt.RightDockWidgetArea, self.widget_multistyler)
-        self.widget_multistyler.hide()
-
         self.action_multistyler = QAction(QIcon(files.getIconPath("symbology")),
                                           QCoreApplication.translate(self.name, "Multistyler"), self._win)
         self.action_multistyler.setObjectName("Multistyler")
-        self.action_multistyler.triggered.connect(self.widget_multistyler.show)
+        self.action_multistyler.triggered.connect(self.showMultistyler)
         self.iface.addPluginToWebMenu(self.name, self.action_multistyler)
 
-        self.iface.currentLayerChanged.connect(self.widget_multistyler.updateForCurrentLayer)
+        self.iface.currentLayerChanged.connect(self.currentLayerChanged)
 
         QgsProject().instance().layerWasAdded.connect(self.layerWasAdded)
         QgsProject().instance().layerWillBeRemoved.connect(self.layerWillBeRemoved)
@@ -86,7 +86,9 @@ class GeocatBridge:
     def unload(self):
         files.removeTempFolder()
     
-        self.iface.currentLayerChanged.disconnect(self.widget_multistyler.updateForCurrentLayer)
+        self.iface.currentLayerChanged.disconnect(self.currentLayerChanged)
+        if self.widget_multistyler is not None:
+            self.iface.removeDockWidget(self.widget_multistyler)
         QgsProject().instance().layerWasAdded.disconnect(self.layerWasAdded)
 
         for layer, func in self._layerSignals.items():
@@ -102,8 +104,24 @@ class GeocatBridge:
 
     _layerSignals = {}
 
+    def showMultistyler(self):
+        """ Shows the Multistyler dock widget (which is created the first time). """
+        if self.widget_multistyler is None:
+            from geocatbridge.ui.multistylerwidget import MultistylerWidget
+            self.widget_multistyler = MultistylerWidget()
+            self.iface.addDockWidget(Qt.RightDockWidgetArea, self.widget_multistyler)
+        self.widget_multistyler.show()
+
+    def currentLayerChanged(self, _):
+        if self.widget_multistyler is not None:
+            self.widget_multistyler.updateForCurrentLayer()
+
+    def styleChanged(self, layer):
+        if self.widget_multistyler is not None:
+            self.widget_multistyler.updateLayer(layer)
+
     def layerWasAdded(self, layer):
-        self._layerSignals[layer] = partial(self.widget_multistyler.updateLayer, layer)
+        self._layerSignals[layer] = partial(self.styleChanged, layer)
         layer.styleChanged.connect(self._layerSignals[layer])
 
     def layerWillBeRemoved(self, layerid):
@@ -113,5 +131,6 @@ class GeocatBridge:
                 return
 
     def publishClicked(self):
+        from geocatbridge.ui.bridgedialog import BridgeDialog
         dialog = BridgeDialog(self.iface.mainWindow())
         dialog.exec_()
@@ -0,0 +1,60 @@
+import json
+import os
+import time
+from threading import RLock
+
+from qgis.PyQt.QtCore import QStandardPaths
+
+from ..utils import meta
+
+#: Default time (in seconds) after which a cached datastore catalog is considered outdated
+DEFAULT_CATALOG_TTL = 24 * 3600
+
+_CATALOG_NAME = "postgis_datastores.json"
+
+_lock = RLock()
+_catalogs = None
+
+
+def _catalogPath():
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation),
+                        meta.PLUGIN_NAMESPACE, _CATALOG_NAME)
+
+
+def _load():
+    global _catalogs
+    if _catalogs is None:
+        try:
+            with open(_catalogPath(), encoding="utf8") as f:
+                _catalogs = json.load(f)
+        except (OSError, ValueError):
+            _catalogs = {}
+    return _catalogs
+
+
+def _save():
+    path = _catalogPath()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(_catalogs, f)
+
+
+def catalogKey(server):
+    """ Returns the cache key for the datastore catalog of the given GeoServer (URL and authentication config). """
+    return f"{server.url}|{server.authid}"
+
+
+def cachedPostgisDatastores(key):
+    """ Returns the cached list of PostGIS datastore names for the given key, or None if missing or expired. """
+    with _lock:
+        entry = _load().get(key)
+        if entry is None or time.time() - entry["time"] >= DEFAULT_CATALOG_TTL:
+            return None
+        return list(entry["datastores"])
+
+
+def storePostgisDatastores(key, names):
+    """ Stores (and persists) the list of PostGIS datastore names for the given key. """
+    with _lock:
+        _load()[key] = {"time": time.time(), "datastores": list(names)}
+        _save()
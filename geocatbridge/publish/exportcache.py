@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from threading import RLock
+
+from qgis.PyQt.QtCore import QStandardPaths
+
+from ..utils import meta
+from ..utils.layers import getLayerSourceStats
+
+#: Default maximum total size (in bytes) of all cached exports
+DEFAULT_CACHE_LIMIT = 2 * 1024 ** 3
+#: Entries that were used less than this number of seconds ago are never evicted (they might still be uploading)
+_EVICTION_GRACE = 600
+
+_INDEX_NAME = "index.json"
+
+
+class ExportCache:
+    """
+    Persistent on-disk cache of exported layer files.
+    Entries are keyed by the layer source file (path, size, modification time), the layer filter,
+    the exported fields and the target format. If the total size exceeds the limit, the least recently
+    used entries are removed.
+    """
+
+    def __init__(self, folder, limit=DEFAULT_CACHE_LIMIT):
+        self.folder = folder
+        self.limit = limit
+        self._lock = RLock()
+        self._index = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(layer, fields, ext, options=None):
+        """
+        Returns the cache key for the export of the given layer with the given fields to a target extension
+        (and with the given format `options`, if any). Returns None if the layer source is not a local file
+        or the layer has unsaved edits, because changes to the data cannot be detected cheaply then.
+        """
+        stats = getLayerSourceStats(layer)
+        if stats is None:
+            return None
+        if layer.type() == layer.VectorLayer:
+            extra = layer.subsetString(), sorted(fields or [])
+        else:
+            extra = layer.width(), layer.height(), layer.extent().toString()
+        values = layer.source(), stats, layer.crs().authid(), extra, ext.lower()
+        if options:
+            values += (options,)
+        return hashlib.sha1(json.dumps(values, default=str).encode("utf-8")).hexdigest()
+
+    def _loadIndex(self):
+        if self._index is None:
+            try:
+                with open(os.path.join(self.folder, _INDEX_NAME), encoding="utf8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _saveIndex(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, _INDEX_NAME), "w", encoding="utf8") as f:
+            json.dump(self._index, f)
+
+    def get(self, key):
+        """ Returns the cached file path for the given key, or None if there is no (valid) cache entry. """
+        with self._lock:
+            entry = self._loadIndex().get(key)
+            if entry is None or not os.path.isfile(os.path.join(self.folder, entry["file"])):
+                self._stats["misses"] += 1
+                return None
+            entry["used"] = time.time()
+            self._stats["hits"] += 1
+            self._saveIndex()
+            return os.path.join(self.folder, entry["file"])
+
+    def newEntryPath(self, basename):
+        """ Returns a new (empty) file path in the cache folder, to which an export can be written. """
+        folder = os.path.join(self.folder, uuid.uuid4().hex)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, basename)
+
+    def put(self, key, path):
+        """ Registers an exported file (and its sidecar files) that was written to a path from `newEntryPath`. """
+        folder = os.path.dirname(path)
+        size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder))
+        with self._lock:
+            index = self._loadIndex()
+            old = index.pop(key, None)
+            if old is not None:
+                # Another thread may still be uploading the replaced export: remove it after the grace period
+                old["replaced"] = True
+                index[uuid.uuid4().hex] = old
+            index[key] = {"file": os.path.relpath(path, self.folder), "size": size, "used": time.time()}
+            self._evict()
+            self._saveIndex()
+
+    def _removeEntryFiles(self, entry):
+        folder = os.path.dirname(os.path.join(self.folder, entry["file"]))
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def _evict(self):
+        """ Removes replaced entries and least recently used entries until the total size is within the limit. """
+        index = self._loadIndex()
+        total = sum(e["size"] for e in index.values())
+        now = time.time()
+        for key, entry in sorted(index.items(), key=lambda kv: kv[1]["used"]):
+            if now - entry["used"] < _EVICTION_GRACE:
+                continue
+            if total <= self.limit and not entry.get("replaced"):
+                continue
+            self._removeEntryFiles(entry)
+            del index[key]
+            total -= entry["size"]
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        """ Removes all cached exports. """
+        with self._lock:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self._index = {}
+
+    def stats(self):
+        """ Returns a dictionary with the number of entries, total size, size limit, hits, misses and evictions. """
+        with self._lock:
+            index = self._loadIndex()
+            return dict(self._stats, entries=len(index), size=sum(e["size"] for e in index.values()),
+                        limit=self.limit)
+
+
+_cache = None
+
+
+def getExportCache():
+    """ Returns the process-wide export cache (created on first use). """
+    global _cache
+    if _cache is None:
+        folder = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation),
+                              meta.PLUGIN_NAMESPACE, "exports")
+        _cache = ExportCache(folder)
+    return _cache
+
+
+def exportCacheStats():
+    """ Returns the export cache statistics (see `ExportCache.stats`). """
+    return getExportCache().stats()
+
+
+def clearExportCache():
+    """ Removes all cached exports from disk. """
+    getExportCache().clear()
@@ -1,3 +1,6 @@
+import os
+import shutil
+
 from ..utils import layers
 
 try:
@@ -5,6 +8,7 @@ try:
 except (ModuleNotFoundError, ImportError):
     import gdal
 
+from qgis.PyQt.QtCore import QCoreApplication, QSettings
 from qgis.core import (
     QgsVectorFileWriter,
     QgsRasterFileWriter,
@@ -12,11 +16,25 @@ from qgis.core import (
     Qgis
 )
 
-from geocatbridge.utils import layers as layerUtils
+from geocatbridge.utils import layers as layerUtils, meta
 from geocatbridge.utils.files import tempFilenameInTempFolder
+from geocatbridge.publish.exportcache import getExportCache
 
 EXT_SHAPEFILE = ".shp"
 EXT_GEOPACKAGE = ".gpkg"
+EXT_GEOTIFF = ".tif"
+
+#: Compression methods that can be used for exported (Cloud-Optimized) GeoTIFFs
+RASTER_COMPRESSIONS = ("DEFLATE", "ZSTD", "JPEG", "LZW", "NONE")
+#: Default compression method for exported rasters
+DEFAULT_RASTER_COMPRESSION = "DEFLATE"
+#: Default JPEG quality (1-100) for JPEG compressed rasters
+DEFAULT_JPEG_QUALITY = 75
+#: Tile size (in pixels) of exported rasters
+RASTER_BLOCK_SIZE = 512
+
+COMPRESSION_SETTING = f"{meta.PLUGIN_NAMESPACE}/rasterCompression"
+JPEG_QUALITY_SETTING = f"{meta.PLUGIN_NAMESPACE}/rasterJpegQuality"
 
 
 def isSingleTableGpkg(layer):
@@ -24,6 +42,142 @@ def isSingleTableGpkg(layer):
     return ds.GetLayerCount() == 1
 
 
+def rasterExportOptions():
+    """ Returns the configured (compression, JPEG quality) for exported rasters. """
+    compression = QSettings().value(COMPRESSION_SETTING, DEFAULT_RASTER_COMPRESSION, type=str).upper()
+    quality = QSettings().value(JPEG_QUALITY_SETTING, DEFAULT_JPEG_QUALITY, type=int)
+    if compression not in RASTER_COMPRESSIONS:
+        compression = DEFAULT_RASTER_COMPRESSION
+    return compression, min(100, max(1, quality))
+
+
+def setRasterExportOptions(compression=None, quality=None):
+    """
+    Sets the compression method (DEFLATE, ZSTD, JPEG, LZW or NONE) and/or the JPEG quality of exported rasters.
+    Options that are not specified keep their current value.
+    """
+    if compression is not None:
+        compression = compression.upper()
+        if compression not in RASTER_COMPRESSIONS:
+            raise ValueError(f"Unsupported raster compression: {compression}")
+        QSettings().setValue(COMPRESSION_SETTING, compression)
+    if quality is not None:
+        QSettings().setValue(JPEG_QUALITY_SETTING, int(quality))
+
+
+def isCloudOptimized(filepath):
+    """
+    Returns True if the given file is a Cloud-Optimized GeoTIFF, i.e. a tiled GeoTIFF
+    with internal overviews (small rasters that fit in a single tile do not need overviews).
+    """
+    ds = gdal.Open(filepath)
+    if ds is None or ds.GetDriver().ShortName != "GTiff":
+        return False
+    if ds.GetMetadataItem("LAYOUT", "IMAGE_STRUCTURE") == "COG":
+        return True
+    if any(f.lower().endswith(".ovr") for f in ds.GetFileList() or []):
+        # GDAL also reports external (.ovr) overviews, which would not be uploaded with the GeoTIFF
+        return False
+    band = ds.GetRasterBand(1)
+    block_width, _ = band.GetBlockSize()
+    if block_width >= ds.RasterXSize and ds.RasterXSize > RASTER_BLOCK_SIZE:
+        # Stripped (untiled) GeoTIFF
+        return False
+    return band.GetOverviewCount() > 0 or max(ds.RasterXSize, ds.RasterYSize) <= RASTER_BLOCK_SIZE
+
+
+def _numThreads():
+    """ Returns the number of GDAL threads per raster export, so that simultaneous exports share the CPUs. """
+    return max(1, (os.cpu_count() or 1) // meta.PUBLISH_WORKERS)
+
+
+def _writeCog(source, output, crs_wkt=None, log=None):
+    """
+    Writes a GDAL raster source as a tiled, compressed GeoTIFF with internal overviews.
+    GDAL 3.1+ writes a real COG. Older versions write a tiled GeoTIFF, to which overviews are added afterwards.
+    """
+    src = gdal.Open(source)
+    if src is None:
+        raise Exception(f"Could not open raster {source}")
+    compression, quality = rasterExportOptions()
+    bands = [src.GetRasterBand(i + 1) for i in range(src.RasterCount)]
+    if compression == "JPEG" and (src.RasterCount not in (1, 3, 4) or
+                                  any(b.DataType != gdal.GDT_Byte for b in bands)):
+        # JPEG only supports 8-bit gray, RGB or RGBA images
+        if log:
+            log(f"JPEG compression is not supported for {source}: using {DEFAULT_RASTER_COMPRESSION} instead")
+        compression = DEFAULT_RASTER_COMPRESSION
+    options = {"outputSRS": crs_wkt} if crs_wkt else {}
+
+    if gdal.GetDriverByName("COG") is not None:
+        creation = [f"COMPRESS={compression}", f"BLOCKSIZE={RASTER_BLOCK_SIZE}", "OVERVIEWS=AUTO",
+                    "BIGTIFF=IF_SAFER", f"NUM_THREADS={_numThreads()}"]
+        if compression in ("DEFLATE", "ZSTD", "LZW"):
+            creation.append("PREDICTOR=YES")
+        elif compression == "JPEG":
+            creation.append(f"QUALITY={quality}")
+        result = gdal.Translate(output, src, format="COG", creationOptions=creation, **options)
+        if result is None:
+            raise Exception(f"Could not write raster {output}")
+        # Closing the dataset flushes it to disk
+        del result
+        return
+
+    creation = [f"COMPRESS={compression}", "TILED=YES", f"BLOCKXSIZE={RASTER_BLOCK_SIZE}",
+                f"BLOCKYSIZE={RASTER_BLOCK_SIZE}", "BIGTIFF=IF_SAFER", f"NUM_THREADS={_numThreads()}"]
+    if compression in ("DEFLATE", "ZSTD", "LZW"):
+        creation.append("PREDICTOR=2")
+    elif compression == "JPEG":
+        creation.append(f"JPEG_QUALITY={quality}")
+    result = gdal.Translate(output, src, format="GTiff", creationOptions=creation, **options)
+    if result is None:
+        raise Exception(f"Could not write raster {output}")
+    factors, size = [], max(result.RasterXSize, result.RasterYSize)
+    while size // (2 ** (len(factors) + 1)) >= RASTER_BLOCK_SIZE // 2:
+        factors.append(2 ** (len(factors) + 1))
+    if factors:
+        result.BuildOverviews("AVERAGE", factors)
+    del result
+
+
+def _copyExport(source, target):
+    """
+    Copies an exported file and its sidecar files (e.g. .dbf, .prj for Shapefiles) to the given target path.
+    File modification times are preserved, so that unchanged exports can be recognized (e.g. by the FTP uploader).
+    """
+    src_dir, src_name = os.path.split(source)
+    src_stem = os.path.splitext(src_name)[0]
+    tgt_dir, tgt_name = os.path.split(target)
+    tgt_stem = os.path.splitext(tgt_name)[0]
+    os.makedirs(tgt_dir or ".", exist_ok=True)
+    for name in os.listdir(src_dir):
+        stem, ext = os.path.splitext(name)
+        if stem == src_stem:
+            shutil.copy2(os.path.join(src_dir, name), os.path.join(tgt_dir, tgt_stem + ext))
+    return target
+
+
+def _cachedExport(layer, fields, ext, basename, path, write, log, options=None):
+    """
+    Exports the layer using the given `write(output)` function, unless a valid export exists in the export cache.
+    If `path` is set, the (cached) export is copied to that path. Otherwise, the cached file path is returned.
+    """
+    cache = getExportCache()
+    key = cache.key(layer, fields, ext, options) if cache.limit > 0 else None
+    if key is None:
+        output = path or tempFilenameInTempFolder(basename)
+        write(output)
+        return output
+    cached = cache.get(key)
+    if cached is None:
+        cached = cache.newEntryPath(basename)
+        write(cached)
+        cache.put(key, cached)
+    else:
+        log(f"Reusing cached export {cached}")
+    return _copyExport(cached, path) if path else cached
+
+
 def exportLayer(layer, fields=None, to_shapefile=False, path=None, force=False, logger=None):
 
     def safeLog(message):
@@ -44,41 +198,106 @@ def exportLayer(layer, fields=None, to_shapefile=False, path=None, force=False,
         else:
             # No need to export
             safeLog(QCoreApplication.translate("GeoCat Bridge", 
-                                               f"No need to export layer {lyr_name} stored at {filepath}")
+                                               f"No need to export layer {lyr_name} stored at {filepath}"))
             return filepath
 
         # Perform GeoPackage or Shapefile export
         attrs = [i for i, f in enumerate(layer.fields()) if len(fields) == 0 or f.name() in fields]
-        output = path or tempFilenameInTempFolder(safe_name + ext)
-
-        if Qgis.QGIS_VERSION_INT < 31003:
-            # Use writeAsVectorFormat for QGIS versions < 3.10.3 for backwards compatibility
-            # noinspection PyArgumentList
-            QgsVectorFileWriter().writeAsVectorFormat(
-                layer, output, fileEncoding="UTF-8", attributes=attrs,
-                driverName="ESRI Shapefile" if ext == EXT_SHAPEFILE else ""
-            )
-        else:
-            # Use writeAsVectorFormatV2 for QGIS versions >= 3.10.3 to avoid DeprecationWarnings
-            transform_ctx = QgsProject().instance().transformContext()
-            options = QgsVectorFileWriter.SaveVectorOptions()
-            options.fileEncoding = "UTF-8"
-            options.attributes = attrs
-            options.driverName = "ESRI Shapefile" if ext == EXT_SHAPEFILE else ""
-            QgsVectorFileWriter().writeAsVectorFormatV2(layer, output, transform_ctx, options)
-        safeLog(QCoreApplication.translate("GeoCat Bridge", f"Layer {lyr_name} exported to {output}")
+
+        def writeVector(output):
+            if Qgis.QGIS_VERSION_INT < 31003:
+                # Use writeAsVectorFormat for QGIS versions < 3.10.3 for backwards compatibility
+                # noinspection PyArgumentList
+                QgsVectorFileWriter().writeAsVectorFormat(
+                    layer, output, fileEncoding="UTF-8", attributes=attrs,
+                    driverName="ESRI Shapefile" if ext == EXT_SHAPEFILE else ""
+                )
+            else:
+                # Use writeAsVectorFormatV2 for QGIS versions >= 3.10.3 to avoid DeprecationWarnings
+                transform_ctx = QgsProject().instance().transformContext()
+                options = QgsVectorFileWriter.SaveVectorOptions()
+                options.fileEncoding = "UTF-8"
+                options.attributes = attrs
+                options.driverName = "ESRI Shapefile" if ext == EXT_SHAPEFILE else ""
+                QgsVectorFileWriter().writeAsVectorFormatV2(layer, output, transform_ctx, options)
+
+        output = _cachedExport(layer, fields, ext, safe_name + ext, path, writeVector, safeLog)
+        safeLog(QCoreApplication.translate("GeoCat Bridge", f"Layer {lyr_name} exported to {output}"))
         return output
     else:
-        # Export raster
-        if force or not filepath.lower().endswith("tif"):
-            output = path or tempFilenameInTempFolder(safe_name + ".tif")
-            writer = QgsRasterFileWriter(output)
+        # Export raster as a Cloud-Optimized GeoTIFF (tiled, compressed, with internal overviews)
+        if filepath.lower().endswith((".tif", ".tiff")) and os.path.isfile(filepath) and isCloudOptimized(filepath):
+            # Cloud-Optimized GeoTIFFs are published (or copied) as they are
+            safeLog(QCoreApplication.translate("GeoCat Bridge",
+                                               f"No need to export layer {lyr_name} stored at {filepath}"))
+            return _copyExport(filepath, path) if path else filepath
+
+        crs_wkt = layer.crs().toWkt() if layer.crs().isValid() else None
+
+        def writeRaster(output):
+            if os.path.isfile(filepath):
+                _writeCog(filepath, output, crs_wkt, safeLog)
+                return
+            # Sources that GDAL cannot read directly (e.g. web services) are written by QGIS first
+            source = tempFilenameInTempFolder(f"{safe_name}_source{EXT_GEOTIFF}")
+            writer = QgsRasterFileWriter(source)
             writer.setOutputFormat("GTiff")
             writer.writeRaster(layer.pipe(), layer.width(), layer.height(), layer.extent(), layer.crs())
             del writer
-            safeLog(QCoreApplication.translate("GeoCat Bridge", f"Layer {lyr_name} exported to {output}")
-            return output
-        else:
-            safeLog(QCoreApplication.translate("GeoCat Bridge", 
-                                               f"No need to export layer {lyr_name} stored at {filepath}")
-            return filepath
+            try:
+                _writeCog(source, output, log=safeLog)
+            finally:
+                os.remove(source)
+
+        output = _cachedExport(layer, fields, EXT_GEOTIFF, safe_name + EXT_GEOTIFF, path, writeRaster, safeLog,
+                               rasterExportOptions())
+        safeLog(QCoreApplication.translate("GeoCat Bridge", f"Layer {lyr_name} exported to {output}"))
+        return output
+
+
+def exportLayersToGeoPackage(layers, path, logger=None, canceled=None):
+    """
+    Exports several vector layers to a single GeoPackage, as one table (with a spatial index) per layer.
+    Tables are named after the safe layer names. An existing file at `path` is overwritten.
+    Layers that fail to export are skipped (and logged as a warning), so that they can be exported separately.
+
+    :param layers:      List of (layer, fields) tuples. If `fields` is empty, all fields of the layer are exported.
+    :param path:        The GeoPackage file path.
+    :param logger:      Optional object with `logInfo` and `logWarning` methods.
+    :param canceled:    Optional function that returns True if the export should stop (before the next layer).
+    :returns:           A dictionary of {safe layer name: table name} for all exported layers.
+    """
+    tables = {}
+    transform_ctx = QgsProject().instance().transformContext()
+    for layer, fields in layers:
+        if canceled and canceled():
+            break
+        lyr_name, safe_name = layerUtils.getLayerTitleAndName(layer)
+        if safe_name in tables:
+            continue
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = "GPKG"
+        options.fileEncoding = "UTF-8"
+        options.layerName = safe_name
+        options.layerOptions = ["SPATIAL_INDEX=YES"]
+        options.attributes = [i for i, f in enumerate(layer.fields()) if not fields or f.name() in fields]
+        # The first layer creates a new file, all other layers are added to it
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer if tables \
+            else QgsVectorFileWriter.CreateOrOverwriteFile
+        try:
+            if Qgis.QGIS_VERSION_INT < 31003:
+                # noinspection PyArgumentList
+                error, message = QgsVectorFileWriter.writeAsVectorFormat(layer, path, options)[:2]
+            else:
+                error, message = QgsVectorFileWriter.writeAsVectorFormatV2(layer, path, transform_ctx, options)[:2]
+        except Exception as e:
+            error, message = None, str(e)
+        if error != QgsVectorFileWriter.NoError:
+            if logger and hasattr(logger, 'logWarning'):
+                logger.logWarning(QCoreApplication.translate("GeoCat Bridge",
+                                                             f"Could not export layer {lyr_name} to {path}: {message}"))
+            continue
+        tables[safe_name] = safe_name
+        if logger and hasattr(logger, 'logInfo'):
+            logger.logInfo(QCoreApplication.translate("GeoCat Bridge", f"Layer {lyr_name} exported to {path}"))
+    return tables
@@ -1,57 +1,261 @@
 import ftplib
 import os
+import posixpath
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+from threading import Lock
+from time import gmtime, strftime, strptime
 
+#: Default number of simultaneous FTP connections used to upload a folder
+DEFAULT_CONNECTIONS = 4
 
-# Code adopted from the ftp exporter included in the qgis2web plugin, by Nyall Dawson
-def uploadFolder(folder, host, port, remote_folder, username, password):
-    ftp = ftplib.FTP()
+
+class _FtpPool:
+    """
+    Pool of logged-in FTP connections. Connections are created on demand (up to `size`)
+    and each connection is used by one thread at a time. The working directory of the connections
+    is never changed: all remote paths are relative to the login directory (or absolute).
+    """
+
+    def __init__(self, host, port, username, password, size):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, int(size))
+        self._idle = Queue()
+        self._created = 0
+        self._lock = Lock()
+        self._all = []
+
+    def _connect(self):
+        ftp = ftplib.FTP()
+        try:
+            ftp.connect(self.host, self.port)
+        except ftplib.all_errors as e:
+            raise Exception(f"Could not connect to FTP server at '{self.host}': {e}")
+        try:
+            ftp.login(self.username, self.password)
+        except ftplib.all_errors as e:
+            raise Exception(f"Login failed for user '{self.username}': {e}")
+        return ftp
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            ftp = self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        with self._lock:
+            self._all.append(ftp)
+        return ftp
+
+    def release(self, ftp):
+        self._idle.put(ftp)
+
+    def discard(self, ftp):
+        """ Closes a connection that is in an unknown state (e.g. after a failed transfer), instead of reusing it. """
+        with self._lock:
+            self._created -= 1
+            if ftp in self._all:
+                self._all.remove(ftp)
+        ftp.close()
+
+    def close(self):
+        with self._lock:
+            for ftp in self._all:
+                try:
+                    ftp.quit()
+                except ftplib.all_errors:
+                    ftp.close()
+            self._all = []
+
+
+def _makeDirs(ftp, path):
+    """ Creates a remote folder and all its missing parent folders (without changing the working directory). """
+    if not path or path in ("/", "."):
+        return
+    parent = posixpath.dirname(path.rstrip("/"))
+    try:
+        ftp.mkd(path)
+    except ftplib.error_perm:
+        # The folder may already exist, or its parent may be missing
+        if parent and parent != path:
+            _makeDirs(ftp, parent)
+            try:
+                ftp.mkd(path)
+            except ftplib.error_perm:
+                pass
+
+
+def _parseFtpTime(value):
+    """ Parses an FTP (MLSD/MDTM) UTC timestamp (YYYYMMDDHHMMSS[.sss]) to seconds since the epoch. """
     try:
-        ftp.connect(host, port)
-    except ftplib.all_errors as e:
-        raise Exception(f"Could not connect to FTP server at '{host}': {e}")
+        return timegm(strptime(value[:14], "%Y%m%d%H%M%S"))
+    except (TypeError, ValueError):
+        return None
 
+
+def _remoteListing(ftp, folder):
+    """
+    Returns a dictionary with the (size, mtime) of all files in a remote folder, using MLSD.
+    Returns None if the server does not support MLSD (or the folder cannot be listed).
+    """
+    try:
+        entries = ftp.mlsd(folder or "", facts=["type", "size", "modify"])
+        return {name: (int(facts["size"]) if "size" in facts else None, _parseFtpTime(facts.get("modify")))
+                for name, facts in entries if facts.get("type") == "file"}
+    except (ftplib.all_errors, ValueError):
+        return None
+
+
+def _remoteStat(ftp, path):
+    """ Returns the (size, mtime) of a remote file using SIZE and MDTM, or (None, None) if it does not exist. """
+    try:
+        ftp.voidcmd("TYPE I")
+        size = ftp.size(path)
+    except ftplib.all_errors:
+        return None, None
     try:
-        ftp.login(username, password)
-    except ftplib.all_errors as e:
-        raise Exception(f"Login failed for user '{username}': {e}")
+        mtime = _parseFtpTime(ftp.voidcmd(f"MDTM {path}")[4:].strip())
+    except ftplib.all_errors:
+        mtime = None
+    return size, mtime
 
-    def cwdAndCreate(p):
-        """
-        Recursively changes directory to an FTP target,
-        creating new folders as required.
-        """
-        if not p:
+
+def _partPath(remote_path, st):
+    """
+    Returns the remote path under which a local file (with the given `os.stat` result) is uploaded until it is complete.
+    The name identifies the local file version, so that only an interrupted transfer of the same file is resumed.
+    """
+    return f"{remote_path}.{st.st_size}-{int(st.st_mtime)}.part"
+
+
+def _setRemoteTime(ftp, path, mtime):
+    """ Sets the modification time of a remote file using MFMT (if the server supports it). """
+    try:
+        ftp.voidcmd(f"MFMT {strftime('%Y%m%d%H%M%S', gmtime(mtime))} {path}")
+    except ftplib.all_errors:
+        pass
+
+
+def _uploadFile(ftp, local_path, remote_path, remote_stat):
+    """
+    Uploads a single file, unless the remote file has exactly the same size and modification time.
+    The file is uploaded to a temporary ".part" file and renamed when complete. If that ".part" file already exists
+    (i.e. an interrupted transfer of the same local file), the upload is resumed.
+    Afterwards, the remote modification time is set to the local one, so that the file is skipped next time.
+
+    :param remote_stat: Function that returns the (size, mtime) of a remote path, or (None, None) if it does not exist.
+    :returns:           True if the file was uploaded, False if it was skipped.
+    """
+    st = os.stat(local_path)
+    if remote_stat(remote_path) == (st.st_size, int(st.st_mtime)):
+        return False
+    part_path = _partPath(remote_path, st)
+    offset = remote_stat(part_path)[0] or 0
+    if offset < st.st_size:
+        with open(local_path, "rb") as fh:
+            if offset:
+                fh.seek(offset)
+                try:
+                    ftp.storbinary(f"STOR {part_path}", fh, rest=offset)
+                    offset = st.st_size
+                except ftplib.error_perm:
+                    # The server does not support resuming: upload the complete file
+                    fh.seek(0)
+            if offset < st.st_size:
+                ftp.storbinary(f"STOR {part_path}", fh)
+    try:
+        ftp.rename(part_path, remote_path)
+    except ftplib.error_perm:
+        # Some servers do not replace an existing file when renaming
+        ftp.delete(remote_path)
+        ftp.rename(part_path, remote_path)
+    _setRemoteTime(ftp, remote_path, st.st_mtime)
+    return True
+
+
+# Code originally adopted from the ftp exporter included in the qgis2web plugin, by Nyall Dawson
+def uploadFolder(folder, host, port, remote_folder, username, password,
+                 connections=DEFAULT_CONNECTIONS, progress=None, canceled=None):
+    """
+    Uploads the contents of a local folder (recursively) to a remote FTP folder, using multiple connections.
+    Files that already exist remotely with the same size and modification time are skipped.
+
+    :param folder:          The local folder to upload.
+    :param host:            The FTP server host name.
+    :param port:            The FTP server port.
+    :param remote_folder:   The remote target folder (created if it does not exist).
+    :param username:        The FTP user name.
+    :param password:        The FTP password.
+    :param connections:     The maximum number of simultaneous FTP connections.
+    :param progress:        Optional function that is called with (processed_files, total_files).
+    :param canceled:        Optional function that returns True if the upload should stop.
+    :returns:               A tuple with the number of uploaded and skipped files.
+    """
+    # Collect all files to upload without changing the (process-wide) working directory
+    jobs, folders = [], []
+    for path, _, files in os.walk(folder):
+        rel = os.path.relpath(path, folder)
+        remote = remote_folder if rel == "." else posixpath.join(remote_folder, *rel.split(os.sep))
+        folders.append((remote, [f for f in files if os.path.isfile(os.path.join(path, f))]))
+        jobs.extend((os.path.join(path, f), remote, f) for f in folders[-1][1])
+
+    pool = _FtpPool(host, port, username, password, connections)
+    listings = {}
+    ftp = pool.acquire()
+    try:
+        for remote, _ in folders:
+            _makeDirs(ftp, remote)
+            listings[remote] = _remoteListing(ftp, remote)
+    finally:
+        pool.release(ftp)
+
+    counts = {"uploaded": 0, "skipped": 0}
+    lock = Lock()
+
+    def _upload(job):
+        local_path, remote, name = job
+        if canceled and canceled():
             return
+        remote_path = posixpath.join(remote, name) if remote else name
+        conn = pool.acquire()
         try:
-            ftp.cwd(p)
-        except ftplib.all_errors:
-            parent, base = os.path.split(p)
-            cwdAndCreate(parent)
-            if base:
-                ftp.mkd(base)
-                ftp.cwd(base)
-
-    cwdAndCreate(remote_folder)
-
-    def uploadPath(path):
-        files = os.listdir(path)
-        os.chdir(path)
-        for f in files:
-            current_path = os.path.join(path, f)
-            if os.path.isfile(current_path):
-                fh = open(f, 'rb')
-                ftp.storbinary(f"STOR {f}", fh)
-                fh.close()
-            elif os.path.isdir(current_path):
-                try:
-                    ftp.mkd(f)
-                except ftplib.all_errors:
-                    pass
-                ftp.cwd(f)
-                if not uploadPath(current_path):
-                    return False
-        ftp.cwd('..')
-        os.chdir('..')
-
-    uploadPath(folder)
-    ftp.close()
+            listing = listings.get(remote)
+
+            def _stat(path):
+                if listing is None:
+                    return _remoteStat(conn, path)
+                return listing.get(posixpath.basename(path), (None, None))
+
+            uploaded = _uploadFile(conn, local_path, remote_path, _stat)
+        except Exception:
+            pool.discard(conn)
+            raise
+        pool.release(conn)
+        with lock:
+            counts["uploaded" if uploaded else "skipped"] += 1
+            if progress:
+                progress(counts["uploaded"] + counts["skipped"], len(jobs))
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            # Consume the results, so that the first upload error is raised
+            for _ in executor.map(_upload, jobs):
+                pass
+    finally:
+        pool.close()
+    return counts["uploaded"], counts["skipped"]
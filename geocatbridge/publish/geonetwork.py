@@ -1,8 +1,17 @@
 import os
+import json
 import zipfile
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+from urllib.parse import urlencode
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from requests.exceptions import HTTPError
+from urllib3.util.retry import Retry
 
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (
@@ -10,36 +19,98 @@ from qgis.core import (
     Qgis
 )
 
-from .metadata import saveMetadata
-from .serverbase import ServerBase
+from .metadata import metadataAsMef
+from .serverbase import (
+    ServerBase,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_TIMEOUT,
+    RETRY_STATUS_CODES
+)
 
 
 class TokenNetworkAccessManager():
+    """
+    Pooled HTTP session for a GeoNetwork catalog that signs in to obtain an XSRF token when it is first needed.
+    If the catalog responds with 403 Forbidden (e.g. because the token or session expired),
+    a new token is requested and the request is sent once more.
+    """
+
     def __init__(self, url, username, password):        
         self.url = url.strip("/")
         self.token = None
+        self._lock = Lock()
+        retries = Retry(total=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                        status_forcelist=RETRY_STATUS_CODES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=DEFAULT_POOL_SIZE, pool_maxsize=DEFAULT_POOL_SIZE,
+                              max_retries=retries)
         self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.session.auth = HTTPBasicAuth(username, password)
-    
+
+    def setPassword(self, password):
+        if self.session.auth.password != password:
+            self.session.auth = HTTPBasicAuth(self.session.auth.username, password)
+            self.token = None
+
     def setTokenInHeader(self):
-        if self.token is None:
-            self.getToken()
-        self.session.headers.update({"X-XSRF-TOKEN" : self.token}) 
+        with self._lock:
+            if self.token is None:
+                self.getToken()
+
+    def send(self, method, url, **kwargs):
+        """ Sends a request with the XSRF token, refreshing the token once if the response is 403 Forbidden. """
+        self.setTokenInHeader()
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        resp = self.session.request(method.upper(), url, **kwargs)
+        if resp.status_code == 403:
+            used_token = resp.request.headers.get("X-XSRF-TOKEN")
+            with self._lock:
+                # Another thread may have refreshed the token already
+                if self.token == used_token:
+                    self.getToken()
+            for f in (kwargs.get("files") or {}).values():
+                if hasattr(f, "seek"):
+                    f.seek(0)
+            resp = self.session.request(method.upper(), url, **kwargs)
+        return resp
 
     def request(self, url, data=None, method="get", headers={}):
         QgsMessageLog.logMessage(QCoreApplication.translate("GeoCat Bridge", "Making '%s' request to '%s'") % (method, url), 'GeoCat Bridge', level=Qgis.Info)
-        self.setTokenInHeader()
-        method = getattr(self.session, method.lower())
-        resp = method(url, headers=headers, data=data)
+        resp = self.send(method, url, headers=headers, data=data)
         resp.raise_for_status()
         return resp
 
     def getToken(self):
         signinUrl = self.url + '/eng/catalog.signin'
-        self.session.post(signinUrl)
+        self.session.cookies.clear()
+        self.session.post(signinUrl, timeout=DEFAULT_TIMEOUT)
         self.token = self.session.cookies.get('XSRF-TOKEN')
         self.session.headers.update({"X-XSRF-TOKEN" : self.token})
 
+
+_sessions = {}
+_sessionsLock = Lock()
+
+
+def getNetworkAccessManager(url, username, password):
+    """
+    Returns the shared `TokenNetworkAccessManager` for the given catalog URL and user, so that all
+    server instances for the same catalog and user reuse the same connections and token.
+    """
+    key = url.strip("/"), username
+    with _sessionsLock:
+        nam = _sessions.get(key)
+        if nam is None:
+            nam = _sessions[key] = TokenNetworkAccessManager(url, username, password)
+        else:
+            nam.setPassword(password)
+        return nam
+
+
 class GeonetworkServer(ServerBase):
 
     PROFILE_DEFAULT = 0
@@ -55,16 +126,22 @@ class GeonetworkServer(ServerBase):
         self._isMetadataCatalog = True
         self._isDataCatalog = False 
         self.node = node
-        user, password = self.getCredentials()
-        self._nam = TokenNetworkAccessManager(self.url, user, password)
 
+    @property
+    def _nam(self):
+        # Credentials are only read (and the session is only created) when the catalog is actually accessed
+        user, password = self.getCredentials()
+        return getNetworkAccessManager(self.url, user, password)
 
     def request(self, url, data=None, method="get", headers={}):
         return self._nam.request(url, data, method, headers)
 
+    def layerMetadataAsMef(self, layer, wms, wfs, layerName):
+        """ Returns the MEF file content (bytes) for the metadata of the given layer. """
+        return metadataAsMef(layer, self.apiUrl(), wms, wfs, layerName)
+
     def publishLayerMetadata(self, layer, wms, wfs, layerName):
-        mefFilename = saveMetadata(layer, None, self.apiUrl(), wms, wfs, layerName)
-        self.publishMetadata(mefFilename)
+        self.publishMetadata(self.layerMetadataAsMef(layer, wms, wfs, layerName))
 
     def testConnection(self):
         try:
@@ -86,20 +163,129 @@ class GeonetworkServer(ServerBase):
         except:
             return False
 
+    def existingMetadata(self, uuids, batch_size=50):
+        """
+        Returns the subset of the given metadata UUIDs for which a record exists in the catalog.
+        Uses a single Elasticsearch query (GeoNetwork 4) or batched searches (GeoNetwork 3)
+        instead of a record request for each UUID.
+        """
+        uuids = list(uuids)
+        if not uuids:
+            return set()
+
+        # GeoNetwork 4.x: search the Elasticsearch index
+        url = self.apiUrl() + "/search/records/_search"
+        query = {"query": {"terms": {"uuid": uuids}}, "_source": ["uuid"], "size": len(uuids)}
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        try:
+            hits = self.request(url, json.dumps(query), "post", headers).json()["hits"]["hits"]
+            return {h["_source"]["uuid"] for h in hits}
+        except (HTTPError, KeyError, ValueError):
+            pass
+
+        # GeoNetwork 3.x: use the Lucene search service (in batches to keep the URL short)
+        found = set()
+        for i in range(0, len(uuids), batch_size):
+            batch = uuids[i:i + batch_size]
+            params = {"_content_type": "json", "fast": "index", "buildSummary": "false",
+                      "_uuid": " or ".join(batch), "from": 1, "to": len(batch)}
+            url = "%s/q?%s" % (self.xmlServicesUrl(), urlencode(params))
+            records = self.request(url).json().get("metadata", [])
+            if isinstance(records, dict):
+                # A single result is not returned as a list
+                records = [records]
+            found.update(r.get("geonet:info", {}).get("uuid") for r in records)
+        return found.intersection(uuids)
+
     def getMetadata(self, uuid):
         url = self.apiUrl() + "/records/" + uuid
         return self.request(url)
 
     def publishMetadata(self, metadata):
-        self._nam.setTokenInHeader()
+        """
+        Uploads a MEF file to the catalog. Existing records with the same UUID are overwritten.
+
+        :param metadata:    The MEF file path, or the MEF file content (bytes).
+        :returns:           The processing report (dict) returned by the catalog (if any).
+        """
         url = self.apiUrl() + "/records"
         headers = {"Accept": "application/json"}
-        params = {"uuidProcessing", "OVERWRITE"}
+        params = {"uuidProcessing": "OVERWRITE"}
+
+        if isinstance(metadata, bytes):
+            files = {'file': ("metadata.mef", metadata, "application/zip")}
+            r = self._nam.send("post", url, files=files, headers=headers, params=params)
+        else:
+            with open(metadata, "rb") as f:
+                files = {'file': f}
+                r = self._nam.send("post", url, files=files, headers=headers, params=params)
+        r.raise_for_status()
+        try:
+            return r.json()
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _reportErrors(report, uuids):
+        """
+        Returns a dictionary with an error message for each of the given UUIDs that were not imported,
+        according to the processing report of a `/records` request.
+        """
+        errors = {}
+        for error in report.get("errors") or []:
+            message = error.get("message") or str(error)
+            uuid = error.get("uuid")
+            if uuid in uuids:
+                errors[uuid] = message
+            else:
+                # Error that cannot be attributed to a single record
+                errors.update((u, message) for u in uuids if u not in errors)
+        processed = report.get("numberOfRecordsProcessed")
+        if not errors and processed is not None and processed < len(uuids):
+            message = f"Only {processed} of {len(uuids)} records were imported"
+            errors.update((u, message) for u in uuids)
+        return errors
+
+    def publishMetadataBatch(self, records, max_workers=None):
+        """
+        Uploads multiple metadata records in a single multi-record MEF (version 2) file.
+        If the catalog rejects the batch, the records are uploaded one by one (using at most `max_workers`
+        simultaneous requests) instead.
+
+        :param records:     A dictionary with the MEF file content (bytes) of a single record for each UUID.
+        :param max_workers: The maximum number of simultaneous uploads when falling back to single uploads.
+        :returns:           A dictionary with an error message for each UUID that could not be published.
+        """
+        if not records:
+            return {}
+        if len(records) > 1:
+            # A MEF2 archive holds one folder per record: merge the folders of the single-record MEF files
+            buffer = BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as batch:
+                for mef in records.values():
+                    with zipfile.ZipFile(BytesIO(mef)) as z:
+                        for info in z.infolist():
+                            batch.writestr(info, z.read(info))
+            try:
+                report = self.publishMetadata(buffer.getvalue())
+                errors = self._reportErrors(report, set(records))
+                if len(errors) < len(records):
+                    return errors
+            except requests.RequestException as e:
+                self.logInfo(f"Batch upload of {len(records)} metadata records failed ({e}): uploading one by one")
+
+        def _publish(uuid):
+            try:
+                return uuid, self._reportErrors(self.publishMetadata(records[uuid]), {uuid}).get(uuid)
+            except Exception as err:
+                return uuid, str(err)
 
-        with open(metadata, "rb") as f:
-            files = {'file': f}
-            r = self._nam.session.post(url, files=files, headers=headers)
-            r.raise_for_status()
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers or DEFAULT_CONCURRENCY) as executor:
+            for uuid, error in executor.map(_publish, records):
+                if error:
+                    errors[uuid] = error
+        return errors
 
     def deleteMetadata(self, uuid):
         url = self.apiUrl() + "/records/" + uuid
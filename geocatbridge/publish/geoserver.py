@@ -1,8 +1,13 @@
 import json
 import os
+import re
 import shutil
 import sqlite3
 import webbrowser
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from threading import RLock
+from time import perf_counter
+from urllib.parse import unquote
 from zipfile import ZipFile
 from requests.exceptions import ConnectionError, HTTPError
 
@@ -11,13 +16,16 @@ from qgis.PyQt.QtWidgets import QMessageBox
 from qgis.core import QgsProject, QgsDataSourceUri
 
 from bridgestyle import mapboxgl
-from bridgestyle.qgis import saveLayerStyleAsZippedSld, layerStyleAsMapboxFolder
+from bridgestyle.qgis import layerStyleAsMapboxFolder
 
-from .exporter import exportLayer
-from .serverbase import ServerBase
+from .exporter import exportLayer, exportLayersToGeoPackage, EXT_GEOPACKAGE, EXT_SHAPEFILE
+from .inventory import WorkspaceInventory
+from .manifest import dataFingerprint, fieldsFingerprint, styleFingerprint
+from .serverbase import ServerBase, RequestCanceled
 from ..utils import layers as layerUtils
 from ..utils.files import tempFilenameInTempFolder, tempFolderInTempFolder, Path
 from ..utils.services import addServicesForGeodataServer
+from ..utils.styles import saveLayerStyleAsZippedSld
 
 
 class GeoserverServer(ServerBase):
@@ -25,6 +33,17 @@ class GeoserverServer(ServerBase):
     POSTGIS_MANAGED_BY_BRIDGE = 1
     POSTGIS_MANAGED_BY_GEOSERVER = 2
 
+    #: Workspace inventory categories and their REST endpoints
+    INVENTORY_CATEGORIES = {
+        "layer": "layers",
+        "style": "styles",
+        "dataStore": "datastores",
+        "coverageStore": "coveragestores"
+    }
+
+    #: Maximum number of simultaneous requests while clearing a workspace or searching the catalog
+    MAX_CONCURRENT_REQUESTS = 8
+
     def __init__(
         self,
         name,
@@ -33,7 +52,9 @@ class GeoserverServer(ServerBase):
         storage=0,
         postgisdb=None,
         useOriginalDataSource=False,
-        useVectorTiles=False
+        useVectorTiles=False,
+        pathMappings=None,
+        singleDatastore=False
     ):
         super().__init__()
         self.name = name
@@ -47,10 +68,17 @@ class GeoserverServer(ServerBase):
         self.postgisdb = postgisdb
         self.useOriginalDataSource = useOriginalDataSource
         self.useVectorTiles = useVectorTiles
+        # List of [local path prefix, path prefix as seen by GeoServer] pairs for shared (e.g. NFS/SMB) storage
+        self.pathMappings = [list(m) for m in pathMappings or []]
+        # If True, all vector layers are uploaded in a single GeoPackage datastore (file based storage only)
+        self.singleDatastore = singleDatastore
+        self._sharedTables = {}
         self._isMetadataCatalog = False
         self._isDataCatalog = True
-        self._layersCache = {}
+        self._inventory = WorkspaceInventory()
+        self._manifest = None
         self._workspace = None
+        self._lock = RLock()
 
     @property
     def workspace(self):
@@ -67,15 +95,115 @@ class GeoserverServer(ServerBase):
     def forceWorkspace(self, workspace):
         self._workspace = workspace
 
-    def prepareForPublishing(self, onlySymbology):
-        if not onlySymbology:
+    def setPathMappings(self, mappings):
+        """
+        Sets the path mappings for data on shared storage, as a list of (local prefix, server prefix) pairs.
+        Layers whose source file is on a mapped location are published by reference (without upload).
+        """
+        self.pathMappings = [[local, remote] for local, remote in mappings]
+
+    def serverPath(self, path):
+        """
+        Returns the path under which GeoServer can access the given local file (using the longest matching
+        local prefix of the path mappings), or None if the file is not on a mapped location.
+        """
+        path = os.path.abspath(path)
+        for local, remote in sorted(self.pathMappings, key=lambda m: len(m[0]), reverse=True):
+            local = os.path.abspath(local)
+            rel = os.path.relpath(path, local) if os.path.splitdrive(path)[0] == os.path.splitdrive(local)[0] else ""
+            if not rel or rel == os.pardir or rel.startswith(os.pardir + os.sep):
+                continue
+            return "/".join([remote.replace("\\", "/").rstrip("/")] + rel.split(os.sep))
+        return None
+
+    def _referencedPath(self, layer, fields=None):
+        """
+        Returns the server path of the layer source file if the layer can be published by reference, or None.
+        This is possible for GeoTIFF rasters and for (unfiltered) GeoPackage or Shapefile vector layers
+        of which all fields are published, if the source file is on a mapped location.
+        """
+        if not self.pathMappings:
+            return None
+        src_path, _, src_ext = layerUtils.getLayerSourceInfo(layer)
+        if not os.path.isfile(src_path):
+            return None
+        if layer.type() == layer.VectorLayer:
+            if self.storage != self.FILE_BASED or src_ext not in (EXT_GEOPACKAGE, EXT_SHAPEFILE):
+                return None
+            if layer.subsetString() or (fields is not None and len(fields) != layer.fields().count()):
+                return None
+        elif src_ext not in (".tif", ".tiff"):
+            return None
+        return self.serverPath(src_path)
+
+    def setInventoryTtl(self, ttl):
+        """ Sets the time (in seconds) after which the workspace inventory is reloaded. Use None to never expire. """
+        self._inventory.ttl = ttl
+
+    def refreshInventory(self):
+        """
+        (Re)loads the index of all layers, styles, datastores and coverage stores in the current workspace
+        (and the list of workspaces) with a single list request per category.
+        """
+        self._inventory.reset(self.workspace)
+        self._loadInventory("workspace", "%s/workspaces.json" % self.url)
+        for category in self.INVENTORY_CATEGORIES:
+            self._loadInventory(category, self._inventoryUrl(category))
+
+    def _inventoryUrl(self, category):
+        return "%s/workspaces/%s/%s.json" % (self.url, self.workspace, self.INVENTORY_CATEGORIES[category])
+
+    def _loadInventory(self, category, url):
+        """ Fetches all item names for the given category from GeoServer and stores them in the inventory. """
+        try:
+            root = self.request(url).json()["%ss" % category]
+        except HTTPError as e:
+            if e.response.status_code != 404:
+                raise
+            # Workspace does not exist (yet), so it does not contain any items
+            root = None
+        items = root.get(category, []) if isinstance(root, dict) else []
+        self._inventory.load(category, (s["name"] for s in items))
+
+    def prepareForPublishing(self, onlySymbology, manifest=None):
+        """
+        Prepares the workspace for publication.
+        If a `PublishManifest` is given, the workspace is published incrementally: it is not cleared
+        and layers whose data and style did not change (according to the manifest) are not published again.
+        """
+        self._manifest = manifest
+        if not onlySymbology and manifest is None:
             self.clearWorkspace()
         self._ensureWorkspaceExists()
+        self.refreshInventory()
         self._uploadedDatasets = {}
         self._exportedLayers = {}
+        self._createdDatastores = {}
+        self._sharedTables = {}
         self._postgisDatastoreExists = False
         self._publishedLayers = set()
 
+    def _isDataUnchanged(self, layer, fields):
+        """ Returns True if the layer is published incrementally and its data did not change since last time. """
+        if self._manifest is None:
+            return False
+        _, safe_name = layerUtils.getLayerTitleAndName(layer)
+        return self.layerExists(safe_name) and self._manifest.isUnchanged(
+            safe_name, data=dataFingerprint(layer), fields=fieldsFingerprint(fields))
+
+    def removeUnpublishedLayers(self, names):
+        """
+        Deletes all layers (and their styles) that were published incrementally before,
+        but are no longer in the given list of layer names (e.g. because they were removed from the project).
+        """
+        if self._manifest is None:
+            return
+        for name in set(self._manifest.names()) - set(names):
+            self.logInfo("Removing layer '%s' that is no longer published" % name)
+            self._deleteLayerAndStore(name)
+            self.deleteStyle(name)
+            self._manifest.discard(name)
+
     def closePublishing(self):
         if not self.useVectorTiles:
             return
@@ -103,10 +231,8 @@ class GeoserverServer(ServerBase):
         self.uploadResource("%s/mapbox.js" % self.workspace, jsFilename)
 
     def uploadResource(self, path, file):
-        with open(file) as f:
-            content = f.read()
         url = "%s/resource/%s" % (self.url, path)
-        self.request(url, content, "put")
+        self.uploadFile(url, file)
 
     def _editMapboxFiles(self, folder):
         filename = os.path.join(folder, "style.mapbox")
@@ -135,19 +261,160 @@ class GeoserverServer(ServerBase):
 
     def publishStyle(self, layer):
         lyr_title, lyr_name = layerUtils.getLayerTitleAndName(layer)
-        export_layer = layerUtils.getExportableLayer(layer, lyr_name)
         styleFilename = tempFilenameInTempFolder(lyr_name + ".zip")
-        warnings = saveLayerStyleAsZippedSld(export_layer, styleFilename)
+        warnings = saveLayerStyleAsZippedSld(layer, styleFilename, lyr_name)
         for w in warnings:
             self.logWarning(w)
         self.logInfo(QCoreApplication.translate("GeoCat Bridge", 
                                                 f"Style for layer '{layer.name()}' exported as ZIP file to '{styleFilename}'"))
-        self._publishStyle(lyr_name, styleFilename)
         self._publishedLayers.add(layer)
+        manifest = self._manifest
+        if manifest is None:
+            self._publishStyle(lyr_name, styleFilename)
+            return styleFilename
+
+        style_fp = styleFingerprint(styleFilename)
+        if self.styleExists(lyr_name) and manifest.isUnchanged(lyr_name, style=style_fp):
+            self.logInfo(f"Style for layer '{layer.name()}' did not change: skipping upload")
+            return styleFilename
+        num_errors = len(self._errors)
+        self._publishStyle(lyr_name, styleFilename)
+        if len(self._errors) == num_errors:
+            manifest.update(lyr_name, style=style_fp)
         return styleFilename
 
+    def _runOnce(self, registry, key, func):
+        """
+        Calls `func()` only once for the given key of `registry` (a dictionary of futures), even if several threads
+        ask for the same key: they wait for the result of the first call. The lock is only held to look up the key,
+        so that calls for different keys (e.g. exports and uploads of different sources) run in parallel.
+
+        :returns:   A tuple of (result, True if this call ran `func`).
+        """
+        with self._lock:
+            future = registry.get(key)
+            first = future is None
+            if first:
+                future = registry[key] = Future()
+        if not first:
+            return future.result(), False
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result, True
+
+    def exportLayerData(self, layer, fields=None):
+        """
+        Exports the layer data to a file that can be uploaded to GeoServer (if required for the storage type).
+        Exported files are cached by source, so that layers sharing the same source are only exported once.
+
+        :param layer:   The QGIS layer to export.
+        :param fields:  The names of the fields to export (vector layers only).
+        :returns:       The exported file path or None if the layer data is not uploaded as a file.
+        """
+        if self._isDataUnchanged(layer, fields) or self._referencedPath(layer, fields) is not None \
+                or self._sharedTable(layer) is not None:
+            return None
+        if layer.type() == layer.VectorLayer:
+            if layer.featureCount() == 0:
+                return None
+            if layer.dataProvider().name() == "postgres" and self.useOriginalDataSource:
+                return None
+            if self.storage not in [self.FILE_BASED, self.POSTGIS_MANAGED_BY_GEOSERVER]:
+                return None
+            src_path, src_name, src_ext = layerUtils.getLayerSourceInfo(layer)
+        else:
+            src_path = layer.source()
+
+        def _export():
+            if layer.type() == layer.RasterLayer:
+                return exportLayer(layer, fields, logger=self)
+            elif self.storage == self.POSTGIS_MANAGED_BY_GEOSERVER:
+                shp_name = exportLayer(layer, fields, to_shapefile=True, force=True, logger=self)
+                basename = os.path.splitext(shp_name)[0]
+                # The Shapefile may be in the export cache: write the ZIP elsewhere, so the cache size stays correct
+                zip_name = tempFilenameInTempFolder(os.path.basename(basename) + ".zip")
+                with ZipFile(zip_name, 'w') as z:
+                    for ext in (".shp", ".shx", ".prj", ".dbf"):
+                        filetozip = basename + ext
+                        z.write(filetozip, arcname=os.path.basename(filetozip))
+                return zip_name
+            return exportLayer(layer, fields, logger=self)
+
+        # Layers that share the same source wait for the first export of that source
+        filename, _ = self._runOnce(self._exportedLayers, src_path, _export)
+        return filename
+
+    @property
+    def sharedDatastoreName(self):
+        """ Returns the name of the GeoPackage datastore that holds all vector layers in single datastore mode. """
+        return "%s_gpkg" % self.workspace
+
+    def _sharedTable(self, layer):
+        """ Returns the table name of the layer in the shared GeoPackage datastore (or None if it is not in there). """
+        return self._sharedTables.get(layerUtils.getLayerTitleAndName(layer)[1])
+
+    def exportLayersData(self, layers):
+        """
+        In single datastore mode, exports all vector layers that are uploaded as a file to one multi-table
+        GeoPackage and uploads it as a single datastore, so that all feature types can be created against it.
+        This is only done when the workspace is published completely (i.e. not incrementally).
+        Layers that could not be exported or uploaded this way are published separately (i.e. by `publishLayer`).
+
+        :param layers:  List of (layer, fields) tuples for all layers that will be published.
+        """
+        self._sharedTables = {}
+        if not self.singleDatastore or self.storage != self.FILE_BASED or self._manifest is not None:
+            return
+        to_export = [(layer, fields) for layer, fields in layers
+                     if layer.type() == layer.VectorLayer and layer.featureCount() > 0
+                     and not (layer.dataProvider().name() == "postgres" and self.useOriginalDataSource)
+                     and self._referencedPath(layer, fields) is None]
+        if not to_export:
+            return
+        filename = tempFilenameInTempFolder(self.sharedDatastoreName + EXT_GEOPACKAGE)
+        tables = exportLayersToGeoPackage(to_export, filename, logger=self, canceled=self.isCanceled)
+        if not tables or self.isCanceled():
+            return
+        try:
+            self._ensureWorkspaceExists()
+            self._deleteDatastore(self.sharedDatastoreName)
+            url = "%s/workspaces/%s/datastores/%s/file.gpkg?configure=none&update=overwrite" % (
+                self.url, self.workspace, self.sharedDatastoreName)
+            self.uploadFile(url, filename)
+        except RequestCanceled:
+            return
+        except Exception as e:
+            self.logWarning("Could not upload GeoPackage datastore '%s' (%s): layers will be uploaded separately"
+                            % (self.sharedDatastoreName, e))
+            return
+        self._inventory.add("dataStore", self.sharedDatastoreName)
+        self.logInfo("Uploaded %d vector layers in GeoPackage datastore '%s'" % (len(tables),
+                                                                                  self.sharedDatastoreName))
+        self._sharedTables = tables
+
     def publishLayer(self, layer, fields=None):
         lyr_title, safe_name = layerUtils.getLayerTitleAndName(layer)
+        manifest = self._manifest
+        if manifest is not None:
+            if self._isDataUnchanged(layer, fields):
+                self.logInfo(f"Data for layer '{lyr_title}' did not change: skipping upload")
+                return
+            # Remove the outdated layer (and its store, if no other layer uses it) before publishing it again
+            self._deleteLayerAndStore(safe_name)
+            num_errors = len(self._errors)
+            self._publishLayer(layer, fields)
+            if len(self._errors) == num_errors:
+                manifest.update(safe_name, data=dataFingerprint(layer), fields=fieldsFingerprint(fields))
+            return
+        self._publishLayer(layer, fields)
+
+    def _publishLayer(self, layer, fields):
+        lyr_title, safe_name = layerUtils.getLayerTitleAndName(layer)
+        server_path = self._referencedPath(layer, fields)
         if layer.type() == layer.VectorLayer:
             if layer.featureCount() == 0:
                 self.logError("Layer '%s' contains zero features and cannot be published" % lyr_title)
@@ -158,21 +425,13 @@ class GeoserverServer(ServerBase):
                 uri = QgsDataSourceUri(layer.source())
                 db = PostgisServer("temp", uri.authConfigId(), uri.host(), uri.port(), uri.schema(), uri.database())
                 self._publishVectorLayerFromPostgis(layer, db)
+            elif server_path is not None:
+                self._publishVectorLayerByReference(layer, server_path)
+            elif self._sharedTable(layer) is not None:
+                self.logInfo("Publishing layer from GeoPackage datastore '%s'" % self.sharedDatastoreName)
+                self._addFeatureType(layer, self.sharedDatastoreName, self._sharedTable(layer))
             elif self.storage in [self.FILE_BASED, self.POSTGIS_MANAGED_BY_GEOSERVER]:
-                src_path, src_name, src_ext = layerUtils.getLayerSourceInfo(layer)
-                filename = self._exportedLayers.get(src_path)
-                if not filename:
-                    if self.storage == self.POSTGIS_MANAGED_BY_GEOSERVER:
-                        shp_name = exportLayer(layer, fields, toShapefile=True, force=True, log=self)
-                        basename = os.path.splitext(shp_name)[0]
-                        filename = basename + ".zip"
-                        with ZipFile(filename, 'w') as z:
-                            for ext in (".shp", ".shx", ".prj", ".dbf"):
-                                filetozip = basename + ext
-                                z.write(filetozip, arcname=os.path.basename(filetozip))
-                    else:
-                        filename = exportLayer(layer, fields, log=self)
-                self._exportedLayers[src_path] = filename
+                filename = self.exportLayerData(layer, fields)
                 if self.storage == self.FILE_BASED:
                     self._publishVectorLayerFromFile(layer, filename)
                 else:
@@ -184,15 +443,16 @@ class GeoserverServer(ServerBase):
                 except KeyError:
                     raise Exception(
                         QCoreApplication.translate("GeoCat Bridge", "Cannot find the selected PostGIS database"))
-                db.importLayer(layer, fields)
+                progress = getattr(self._threadState, "progress", None)
+                if not db.importLayer(layer, fields, progress=progress, canceled=self.isCanceled):
+                    return
                 self._publishVectorLayerFromPostgis(layer, db)
         elif layer.type() == layer.RasterLayer:
-            if layer.source() not in self._exportedLayers:
-                path = exportLayer(layer, fields, log=self)
-                self._exportedLayers[layer.source()] = path
-            filename = self._exportedLayers[layer.source()]
-            self._publishRasterLayer(filename, safe_name)
-        self._clearCache()
+            if server_path is not None:
+                self._publishRasterLayerByReference(server_path, safe_name)
+            else:
+                filename = self.exportLayerData(layer, fields)
+                self._publishRasterLayer(filename, safe_name)
 
     def _getPostgisDatastores(self, ds_list_url=None):
         """
@@ -214,12 +474,17 @@ class GeoserverServer(ServerBase):
 
         for ds_url in (s.get("href") for s in res.get("dataStore", [])):
             ds = self.request(ds_url).json().get("dataStore", {})
-            ds_name, enabled, params = ds.get("name"), ds.get("enabled"), ds.get("connectionParameters", {})
-            # Only yield dataStore if it is enabled and the "dbtype" parameter equals "postgis"
-            # Using the "type" property does not work in all cases (e.g. for JNDI connection pools or NG)
-            entries = {e["@key"]: e["$"] for e in params.get("entry", [])}
-            if enabled and entries.get("dbtype").startswith("postgis"):
-                yield ds_name
+            if self._isPostgisDatastore(ds):
+                yield ds.get("name")
+
+    @staticmethod
+    def _isPostgisDatastore(ds):
+        """ Returns True if the given datastore definition is an enabled PostGIS datastore. """
+        params = ds.get("connectionParameters", {})
+        # Only accept the dataStore if it is enabled and the "dbtype" parameter equals "postgis"
+        # Using the "type" property does not work in all cases (e.g. for JNDI connection pools or NG)
+        entries = {e["@key"]: e["$"] for e in params.get("entry", [])}
+        return bool(ds.get("enabled")) and str(entries.get("dbtype", "")).startswith("postgis")
 
     def createPostgisDatastore(self):
         """
@@ -227,7 +492,10 @@ class GeoserverServer(ServerBase):
 
         :returns:   The existing or created PostGIS datastore name.
         """
+        datastore, _ = self._runOnce(self._createdDatastores, self.postgisdb, self._createPostgisDatastore)
+        return datastore
 
+    def _createPostgisDatastore(self):
         # Check if current workspaces has a PostGIS datastore (use first)
         for ds_name in self._getPostgisDatastores():
             return ds_name
@@ -272,19 +540,22 @@ class GeoserverServer(ServerBase):
     def _publishVectorLayerFromFile(self, layer, filename):
         self.logInfo("Publishing layer from file: %s" % filename)
         title, name = layerUtils.getLayerTitleAndName(layer)
-        isDataUploaded = filename in self._uploadedDatasets
-        if not isDataUploaded:
-            with open(filename, "rb") as f:
-                self._deleteDatastore(name)
-                url = "%s/workspaces/%s/datastores/%s/file.gpkg?update=overwrite" % (self.url, self.workspace, name)
-                self.request(url, f.read(), "put")
+
+        def _upload():
+            self._deleteDatastore(name)
+            url = "%s/workspaces/%s/datastores/%s/file.gpkg?update=overwrite" % (self.url, self.workspace, name)
+            self.uploadFile(url, filename)
             conn = sqlite3.connect(filename)
             cursor = conn.cursor()
             cursor.execute("SELECT table_name FROM gpkg_geometry_columns")
             tablename = cursor.fetchall()[0][0]
-            self._uploadedDatasets[filename] = (name, tablename)
+            conn.close()
+            self._inventory.add("dataStore", name)
+            return name, tablename
 
-        datasetName, geoserverLayerName = self._uploadedDatasets[filename]
+        # Layers that share the same exported file wait for its upload and add a feature type to its datastore
+        (datasetName, geoserverLayerName), isUploader = self._runOnce(self._uploadedDatasets, filename, _upload)
+        isDataUploaded = not isUploader
         url = "%s/workspaces/%s/datastores/%s/featuretypes/%s.json" % (
             self.url, self.workspace, datasetName, geoserverLayerName)
         r = self.request(url)
@@ -305,10 +576,54 @@ class GeoserverServer(ServerBase):
         else:
             self.request(url, ft, "put")
         self.logInfo("Successfully created feature type from GeoPackage file '%s'" % filename)
+        self._inventory.add("layer", name)
+        self._inventory.setLayerStore(name, "dataStore", datasetName)
+        self._setLayerStyle(name)
+
+    def _publishVectorLayerByReference(self, layer, server_path):
+        """ Registers the GeoPackage or Shapefile of the layer as an external datastore (no data is uploaded). """
+        self.logInfo("Publishing layer by reference to file: %s" % server_path)
+        _, name = layerUtils.getLayerTitleAndName(layer)
+        src_path, _, src_ext = layerUtils.getLayerSourceInfo(layer)
+        if src_ext == EXT_GEOPACKAGE:
+            # The table name is part of the layer source (e.g. "data.gpkg|layername=roads") if there are several
+            options = dict(p.split("=", 1) for p in layer.source().split("|")[1:] if "=" in p)
+            table = options.get("layername")
+            if not table:
+                conn = sqlite3.connect(src_path)
+                table = conn.execute("SELECT table_name FROM gpkg_geometry_columns").fetchone()[0]
+                conn.close()
+            ext = "gpkg"
+        else:
+            table = os.path.splitext(os.path.basename(src_path))[0]
+            ext = "shp"
+        self._deleteDatastore(name)
+        url = "%s/workspaces/%s/datastores/%s/external.%s?configure=none" % (self.url, self.workspace, name, ext)
+        self.request(url, "file:" + server_path, "put", {"Content-Type": "text/plain"})
+        self._inventory.add("dataStore", name)
+        self._addFeatureType(layer, name, table)
+
+    def _addFeatureType(self, layer, datastore, table):
+        """ Creates a feature type (and layer) for the given table of an existing datastore and sets its style. """
+        title, name = layerUtils.getLayerTitleAndName(layer)
+        ft = {
+            "featureType": {
+                "name": name,
+                "nativeName": table,
+                "title": title,
+                "srs": layer.crs().authid()
+            }
+        }
+        url = "%s/workspaces/%s/datastores/%s/featuretypes" % (self.url, self.workspace, datastore)
+        self.request(url, ft, "post")
+        self.logInfo("Successfully created feature type '%s' in datastore '%s'" % (name, datastore))
+        self._inventory.add("layer", name)
+        self._inventory.setLayerStore(name, "dataStore", datastore)
         self._setLayerStyle(name)
 
     def _publishVectorLayerFromPostgis(self, layer, db):
-        name = layer.name()
+        # The datastore and feature type are named after the safe layer name, the table after the layer name
+        _, name = layerUtils.getLayerTitleAndName(layer)
         username, password = db.getCredentials()
 
         def _entry(k, v):
@@ -331,17 +646,12 @@ class GeoserverServer(ServerBase):
                 }
             }
         }
+        # A datastore with the same name may have been kept (or restored) from a previous publication
+        self._deleteDatastore(name)
         dsUrl = "%s/workspaces/%s/datastores/" % (self.url, self.workspace)
         self.request(dsUrl, data=ds, method="post")
-        ft = {
-            "featureType": {
-                "name": name,
-                "srs": layer.crs().authid()
-            }
-        }
-        ftUrl = "%s/workspaces/%s/datastores/%s/featuretypes" % (self.url, self.workspace, name)
-        self.request(ftUrl, data=ft, method="post")
-        self._setLayerStyle(name)
+        self._inventory.add("dataStore", name)
+        self._addFeatureType(layer, name, layer.name())
 
     def _getImportResult(self, importId, taskId):
         """ Get the error message on the import task (if any) and the resulting layer name. """
@@ -405,7 +715,12 @@ class GeoserverServer(ServerBase):
             self.logError("Failed to publish QGIS layer '%s' as '%s'.\n\n%s" % (title, ft_name, import_err))
             return
 
-        self._uploadedDatasets[filename] = (datastore, source_name)
+        uploaded = Future()
+        uploaded.set_result((datastore, source_name))
+        with self._lock:
+            self._uploadedDatasets[filename] = uploaded
+        self._inventory.add("layer", tmp_name)
+        self._inventory.setLayerStore(tmp_name, "dataStore", datastore)
 
         # Get the created feature type
         self.logInfo("Checking if feature type creation was successful...")
@@ -442,12 +757,26 @@ class GeoserverServer(ServerBase):
 
     def _publishRasterLayer(self, filename, layername):
         self._ensureWorkspaceExists()
-        with open(filename, "rb") as f:
-            url = "%s/workspaces/%s/coveragestores/%s/file.geotiff" % (self.url, self.workspace, layername)
-            self.request(url, f.read(), "put")
+        url = "%s/workspaces/%s/coveragestores/%s/file.geotiff" % (self.url, self.workspace, layername)
+        self.uploadFile(url, filename)
+        self._inventory.add("coverageStore", layername)
+        self._inventory.add("layer", layername)
+        self._inventory.setLayerStore(layername, "coverageStore", layername)
         self.logInfo("Successfully created coverage from TIFF file '%s'" % filename)
         self._setLayerStyle(layername)
 
+    def _publishRasterLayerByReference(self, server_path, layername):
+        """ Registers the GeoTIFF of the layer as an external coverage store (no data is uploaded). """
+        self._ensureWorkspaceExists()
+        url = "%s/workspaces/%s/coveragestores/%s/external.geotiff?configure=first&coverageName=%s" % (
+            self.url, self.workspace, layername, layername)
+        self.request(url, "file:" + server_path, "put", {"Content-Type": "text/plain"})
+        self._inventory.add("coverageStore", layername)
+        self._inventory.add("layer", layername)
+        self._inventory.setLayerStore(layername, "coverageStore", layername)
+        self.logInfo("Successfully created coverage from external TIFF file '%s'" % server_path)
+        self._setLayerStyle(layername)
+
     def createGroups(self, groups, qgis_layers):
         for group in groups:
             self._publishGroup(group, qgis_layers)
@@ -477,6 +806,7 @@ class GeoserverServer(ServerBase):
         url = self.url + "/workspaces/%s/styles" % (self.workspace)
 
         response = self.request(url, xml, "POST", {"Content-Type": "text/xml"})
+        self._inventory.add("style", name)
         url = self.url + "/workspaces/%s/styles/%s?raw=true" % (self.workspace, name)
 
         headers = {"Content-Type": "application/vnd.geoserver.mbstyle+json"}
@@ -554,24 +884,16 @@ class GeoserverServer(ServerBase):
             # Swallow error if style does not exist (404), re-raise otherwise
             if e.response.status_code != 404:
                 raise
-
-    def _clearCache(self):
-        self._layersCache = None
+        self._inventory.remove("style", name)
 
     def _exists(self, url, category, name):
+        if self._inventory.workspace != self.workspace:
+            # Workspace has changed (or was forced): inventory no longer applies
+            self._inventory.reset(self.workspace)
         try:
-            if category != "layer" or self._layersCache is None:
-                r = self.request(url)
-                root = r.json()["%ss" % category]
-                if category in root:
-                    items = [s["name"] for s in root[category]]
-                    if category == "layer":
-                        self._layersCache = items
-                else:
-                    return False
-            else:
-                items = self._layersCache
-            return name in items
+            if not self._inventory.isLoaded(category):
+                self._loadInventory(category, url)
+            return self._inventory.contains(category, name)
         except:
             return False
 
@@ -613,6 +935,9 @@ class GeoserverServer(ServerBase):
             # Swallow error if datastore does not exist (404), re-raise otherwise
             if e.response.status_code != 404:
                 raise
+        self._inventory.remove("dataStore", name)
+        # Datastores created by Bridge have the same name as their layer, which is removed recursively
+        self._inventory.remove("layer", name)
 
     def deleteLayer(self, name, recurse=True):
         param = '?recurse=true' if recurse else ""
@@ -623,6 +948,72 @@ class GeoserverServer(ServerBase):
             # Swallow error if layer does not exist (404), re-raise otherwise
             if e.response.status_code != 404:
                 raise
+        self._inventory.remove("layer", name)
+
+    def _layerStore(self, name):
+        """
+        Returns the (category, name) of the store that holds the data of the given layer, or None if there is no
+        such layer. If the store is not in the inventory, it is derived from the layer resource on GeoServer.
+        """
+        store = self._inventory.layerStore(name)
+        if store is not None:
+            return store
+        url = "%s/workspaces/%s/layers/%s.json" % (self.url, self.workspace, name)
+        try:
+            href = self.request(url).json()["layer"]["resource"]["href"]
+        except HTTPError as e:
+            # Swallow error if layer does not exist (404), re-raise otherwise
+            if e.response.status_code != 404:
+                raise
+            return None
+        match = re.search(r"/(datastores|coveragestores)/([^/]+)/", href)
+        if not match:
+            return None
+        category = "dataStore" if match.group(1) == "datastores" else "coverageStore"
+        store = category, unquote(match.group(2))
+        self._inventory.setLayerStore(name, *store)
+        return store
+
+    def _deleteLayerAndStore(self, name):
+        """
+        Deletes a layer and the store that holds its data, unless other layers still use that store
+        or it is the PostGIS datastore that is configured for this server.
+        """
+        store = self._layerStore(name)
+        self.deleteLayer(name)
+        if store is None:
+            return
+        category, store_name = store
+        if self.postgisdb == "%s:%s" % (self.workspace, store_name):
+            return
+        resources, resource = ("featureTypes", "featureType") if category == "dataStore" \
+            else ("coverages", "coverage")
+        url = "%s/workspaces/%s/%s/%s/%s.json" % (self.url, self.workspace, self.INVENTORY_CATEGORIES[category],
+                                                  store_name, resources.lower())
+        try:
+            root = self.request(url).json().get(resources)
+        except HTTPError as e:
+            # Swallow error if store does not exist (404), re-raise otherwise
+            if e.response.status_code != 404:
+                raise
+            return
+        if isinstance(root, dict) and root.get(resource):
+            # The store is shared with other layers
+            return
+        if category == "dataStore":
+            self._deleteDatastore(store_name)
+        else:
+            self._deleteCoverageStore(store_name)
+
+    def _deleteCoverageStore(self, name):
+        url = "%s/workspaces/%s/coveragestores/%s?recurse=true" % (self.url, self.workspace, name)
+        try:
+            self.request(url, method="delete")
+        except HTTPError as e:
+            # Swallow error if coverage store does not exist (404), re-raise otherwise
+            if e.response.status_code != 404:
+                raise
+        self._inventory.remove("coverageStore", name)
 
     def openPreview(self, names, bbox, srs):
         url = self.layerPreviewUrl(names, bbox, srs)
@@ -661,37 +1052,68 @@ class GeoserverServer(ServerBase):
         }
         self.request(resourceUrl, data=layer, method="put")
 
+    def _concurrentRequests(self, func, items):
+        """
+        Calls `func` for all items using a bounded number of threads (that share the pooled HTTP session)
+        and returns the results in the same order. The first error (if any) is raised.
+        """
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        workers = max(1, min(self.MAX_CONCURRENT_REQUESTS, self._poolSize, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, items))
+
     def clearWorkspace(self):
         """
         Clears all feature types and coverages (rasters) and their corresponding layers.
         Leaves styles and datastore definitions in tact.
+        Returns a dictionary with the duration (in seconds) of each phase.
         """
+        timings = {}
+        start = perf_counter()
+
+        def _phaseDone(phase):
+            nonlocal start
+            now = perf_counter()
+            timings[phase] = now - start
+            start = now
+            self.logInfo(f"Clearing workspace '{self.workspace}': {phase} took {timings[phase]:.2f} seconds")
+
         if not self.workspaceExists():
             # Nothing to delete: workspace does not exist yet (so let's create it)
             self._createWorkspace()
-            return
+            _phaseDone("create workspace")
+            return timings
 
-        # Get database datastores configuration
-        db_stores = []
+        # Get database datastores configuration (all datastore details are fetched simultaneously)
         url = "%s/workspaces/%s/datastores.json" % (self.url, self.workspace)
         stores = self.request(url).json()["dataStores"] or {}
-        for store in stores.get("dataStore", []):
-            url = "%s/workspaces/%s/datastores/%s.json" % (self.url, self.workspace, store["name"])
-            ds = self.request(url).json()
+        urls = ["%s/workspaces/%s/datastores/%s.json" % (self.url, self.workspace, store["name"])
+                for store in stores.get("dataStore", [])]
+        db_stores = []
+        for ds in self._concurrentRequests(lambda u: self.request(u).json(), urls):
             params = ds["dataStore"].get("connectionParameters", {})
             if any(entry["@key"] == "dbtype" for entry in params.get("entry", [])):
-                # Fix namespace
-                if self._fixNamespaceParam(params):
-                    self.request(url, ds, "put")
                 # Store copy of datastore configuration if it's a database
                 db_stores.append(dict(ds))
+        _phaseDone("datastore discovery")
 
         # Remove all styles with purge=true option to prevent SLD leftovers
         url = "%s/workspaces/%s/styles.json" % (self.url, self.workspace)
         styles = self.request(url).json()["styles"] or {}
-        for style in styles.get("style", []):
-            url = "%s/workspaces/%s/styles/%s.json?recurse=true&purge=true" % (self.url, self.workspace, style["name"])
-            self.request(url, method="delete")
+
+        def _purgeStyle(name):
+            style_url = "%s/workspaces/%s/styles/%s.json?recurse=true&purge=true" % (self.url, self.workspace, name)
+            try:
+                self.request(style_url, method="delete")
+            except HTTPError as e:
+                # Swallow error if style does not exist (anymore), re-raise otherwise
+                if e.response.status_code != 404:
+                    raise
+
+        self._concurrentRequests(_purgeStyle, (style["name"] for style in styles.get("style", [])))
+        _phaseDone("style purge")
 
         # Delete workspace recursively
         url = "%s/workspaces/%s.json?recurse=true" % (self.url, self.workspace)
@@ -699,32 +1121,57 @@ class GeoserverServer(ServerBase):
 
         # Recreate the workspace
         self._createWorkspace()
+        _phaseDone("workspace recreation")
+
+        # Add all database datastores, with their namespace set to the namespace of the new workspace
+        if db_stores:
+            namespace = None
+            if any(self._namespaceEntry(body["dataStore"].get("connectionParameters", {})) for body in db_stores):
+                # The namespace URI is only fetched if one of the datastores needs it
+                namespace = self._namespaceUri()
+            for body in db_stores:
+                entry = self._namespaceEntry(body["dataStore"].get("connectionParameters", {}))
+                if entry is not None and namespace is not None:
+                    entry["$"] = namespace
+
+            def _addStore(body):
+                self.request("%s/workspaces/%s/datastores.json" % (self.url, self.workspace), body, "post")
+                self._inventory.add("dataStore", body["dataStore"]["name"])
+
+            self._concurrentRequests(_addStore, db_stores)
+        _phaseDone("datastore restore")
+        return timings
+
+    @staticmethod
+    def _namespaceEntry(params):
+        """ Returns the namespace entry of the given datastore connection parameters (or None if there is none). """
+        for entry in params.get("entry", []):
+            if entry["@key"] == "namespace":
+                return entry
+        return None
 
-        # Add all database datastores
-        for body in db_stores:
-            url = "%s/workspaces/%s/datastores.json" % (self.url, self.workspace)
-            self.request(url, body, "post")
-
-        self._clearCache()
+    def _namespaceUri(self):
+        """ Returns the namespace URI for the current workspace, or None if the namespace does not exist. """
+        url = "%s/namespaces/%s.json" % (self.url, self.workspace)
+        try:
+            return self.request(url).json()["namespace"]["uri"]
+        except HTTPError:
+            self.logWarning("GeoServer namespace '%s' does not exist" % self.workspace)
+            return None
 
     def _fixNamespaceParam(self, params):
         """
         Fixes the namespace connection parameter to match the namespace URI for the current workspace.
         If the fix was applied successfully, True is returned.
         """
-        for entry in params.get("entry", []):
-            if entry["@key"] != "namespace":
-                continue
-            # Get expected namespace endpoint
-            url = "%s/namespaces/%s.json" % (self.url, self.workspace)
-            try:
-                ns = self.request(url).json()
-            except HTTPError:
-                self.logWarning("GeoServer namespace '%s' does not exist")
-                return False
-            entry["$"] = ns["namespace"]["uri"]
-            return True
-        return False
+        entry = self._namespaceEntry(params)
+        if entry is None:
+            return False
+        namespace = self._namespaceUri()
+        if namespace is None:
+            return False
+        entry["$"] = namespace
+        return True
 
     def _publishStyle(self, name, style_filepath):
         # Make sure that the workspace is present
@@ -765,6 +1212,7 @@ class GeoserverServer(ServerBase):
             except HTTPError as e:
                 self.logError("Failed to create new style '%s' in workspace '%s':\n%s" % (name, self.workspace, e))
                 return
+            self._inventory.add("style", name)
             self.logInfo(QCoreApplication.translate("GeoCat Bridge",
                                                     "Successfully created style '%s' in workspace '%s'"
                                                     % (name, self.workspace)))
@@ -859,25 +1307,71 @@ class GeoserverServer(ServerBase):
         url = "%s/workspaces" % self.url
         ws = {"workspace": {"name": self.workspace}}
         self.request(url, data=ws, method="post")
+        # A new workspace is empty: no need to fetch its inventory
+        self._inventory.reset(self.workspace, ["workspace", *self.INVENTORY_CATEGORIES])
+        self._inventory.add("workspace", self.workspace)
 
     def _ensureWorkspaceExists(self):
         if not self.workspaceExists():
             self._createWorkspace()
 
-    def postgisDatastores(self):
-        pg_datastores = []
+    def postgisDatastores(self, found=None, canceled=None):
+        """
+        Returns a list of all enabled PostGIS datastores on the server, as "workspace:datastore" names.
+        The datastore lists and details of all workspaces are requested concurrently.
+        Workspaces or datastores that cannot be read are skipped (with a warning).
+
+        :param found:       Optional function that is called with each name as soon as it is found.
+        :param canceled:    Optional function that returns True if the search should stop.
+        :returns:           The names in workspace and datastore order.
+        """
         url = "%s/workspaces.json" % self.url
         res = self.request(url).json().get("workspaces", {})
         if not res:
             # There aren't any workspaces (and thus no dataStores)
-            return pg_datastores
-        for ws_url in (s.get("href") for s in res.get("workspace", [])):
-            props = self.request(ws_url).json().get("workspace", {})
-            ws_name, ds_list_url = props.get("name"), props.get("dataStores")
-            for ds_name in self._getPostgisDatastores(ds_list_url):
-                pg_datastores.append("%s:%s" % (ws_name, ds_name))
-        return pg_datastores
-        
+            return []
+        # The datastores endpoint can be derived from the workspace name: no need to request each workspace
+        ws_names = [w.get("name") for w in res.get("workspace", [])]
+        results = {}
+        lock = RLock()
+
+        def _checkDatastore(key, ws_name, ds_url):
+            if canceled and canceled():
+                return
+            try:
+                ds = self.request(ds_url).json().get("dataStore", {})
+            except Exception as e:
+                self.logWarning("Could not read GeoServer datastore '%s': %s" % (ds_url, e))
+                return
+            if self._isPostgisDatastore(ds):
+                name = "%s:%s" % (ws_name, ds.get("name"))
+                with lock:
+                    results[key] = name
+                if found:
+                    found(name)
+
+        workers = max(1, min(self.MAX_CONCURRENT_REQUESTS, self._poolSize))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            lists = {executor.submit(self.request, "%s/workspaces/%s/datastores.json" % (self.url, ws_name)): i
+                     for i, ws_name in enumerate(ws_names)}
+            checks = []
+            for future in as_completed(lists):
+                if canceled and canceled():
+                    for f in lists:
+                        f.cancel()
+                    break
+                i = lists[future]
+                try:
+                    stores = future.result().json().get("dataStores") or {}
+                except Exception as e:
+                    self.logWarning("Could not list datastores of GeoServer workspace '%s': %s" % (ws_names[i], e))
+                    continue
+                for j, store in enumerate(stores.get("dataStore", [])):
+                    checks.append(executor.submit(_checkDatastore, (i, j), ws_names[i], store.get("href")))
+            for future in checks:
+                future.result()
+        return [results[key] for key in sorted(results)]
+
     def addPostgisDatastore(self, datastoreDef):        
         url = "%s/workspaces/%s/datastores/" % (self.url, self.workspace)
         self.request(url, data=datastoreDef, method="post")
@@ -911,13 +1405,14 @@ class GeoserverServer(ServerBase):
             # version format might not be the expected. This is usually a RC or dev version, so we consider it ok
             self.logWarning("Failed to retrieve GeoServer version info:\n%s" % e)
 
-    def validateGeodataBeforePublication(self, errors, toPublish, onlySymbology):
+    def validateGeodataBeforePublication(self, errors, toPublish, onlySymbology, incremental=False):
         if not self.workspace:
             errors.add("QGIS Project is not saved. Project must be saved before publishing layers to GeoServer.")
         if "." in self.workspace:
             errors.add("QGIS project name contains unsupported characters ('.'). "
                        "Please save with a different name and try again.")
-        if self.willDeleteLayersOnPublication(toPublish) and not onlySymbology:
+        # Incremental publication keeps the layers that are not published (only removed project layers are deleted)
+        if not (onlySymbology or incremental) and self.willDeleteLayersOnPublication(toPublish):
             ret = QMessageBox.question(None, "Workspace",
                                        "A workspace named '%s' already exists and contains layers that will be deleted."
                                        "\nDo you want to proceed?" % self.workspace,
@@ -0,0 +1,87 @@
+import time
+from threading import RLock
+
+
+class WorkspaceInventory:
+    """
+    Index of the names of GeoServer catalog items (e.g. layers, styles, datastores) by category.
+    Each category is loaded once (in bulk) and then kept up to date by the caller using `add` and `remove`,
+    so that existence checks do not require a full list request to GeoServer every time.
+    If a TTL (in seconds) is set, a loaded category expires and should be loaded again after that time.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.workspace = None
+        self._items = {}
+        self._loadTimes = {}
+        self._layerStores = {}
+        self._lock = RLock()
+
+    def reset(self, workspace=None, categories=()):
+        """
+        Clears the inventory for the given workspace.
+        The given `categories` are marked as loaded and empty (e.g. because the workspace was just created).
+        """
+        with self._lock:
+            self.workspace = workspace
+            self._items.clear()
+            self._loadTimes.clear()
+            self._layerStores.clear()
+            for category in categories:
+                self.load(category, [])
+
+    def isLoaded(self, category):
+        """ Returns True if the given category has been loaded and did not expire yet. """
+        with self._lock:
+            loaded_at = self._loadTimes.get(category)
+            if loaded_at is None:
+                return False
+            return self.ttl is None or time.monotonic() - loaded_at < self.ttl
+
+    def load(self, category, names):
+        """ Replaces all item names for the given category. """
+        with self._lock:
+            self._items[category] = set(names)
+            self._loadTimes[category] = time.monotonic()
+
+    def invalidate(self, category=None):
+        """ Marks the given category (or all categories if not specified) as not loaded. """
+        with self._lock:
+            if category is None:
+                self._loadTimes.clear()
+            else:
+                self._loadTimes.pop(category, None)
+
+    def contains(self, category, name):
+        """ Returns True if the item exists. The category should have been loaded first. """
+        with self._lock:
+            return name in self._items.get(category, ())
+
+    def names(self, category):
+        """ Returns a sorted list of all known item names for the given category. """
+        with self._lock:
+            return sorted(self._items.get(category, ()))
+
+    def add(self, category, name):
+        """ Registers a newly created item. Ignored if the category has not been loaded. """
+        with self._lock:
+            if category in self._items:
+                self._items[category].add(name)
+
+    def remove(self, category, name):
+        """ Unregisters a deleted item. """
+        with self._lock:
+            self._items.get(category, set()).discard(name)
+            if category == "layer":
+                self._layerStores.pop(name, None)
+
+    def setLayerStore(self, layer, category, store):
+        """ Registers the store (a "dataStore" or "coverageStore" category and name) that holds the layer data. """
+        with self._lock:
+            self._layerStores[layer] = category, store
+
+    def layerStore(self, layer):
+        """ Returns the (category, name) of the store that holds the layer data, or None if it is not known. """
+        with self._lock:
+            return self._layerStores.get(layer)
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import zipfile
+from threading import RLock
+
+from qgis.PyQt.QtXml import QDomDocument
+from qgis.core import QgsApplication, QgsProject
+
+from ..utils import meta
+from ..utils.layers import getLayerSourceStats
+
+#: Fingerprint kinds that are stored for each published layer
+DATA, STYLE, METADATA, FIELDS = "data", "style", "metadata", "fields"
+
+
+def _hash(*values):
+    """ Returns a SHA-1 hex digest of the JSON representation of the given values. """
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def dataFingerprint(layer):
+    """
+    Returns a fingerprint of the layer data that changes when the source data or the layer filter changes.
+    The size and modification time of the source file and its sidecar files are used,
+    so that the data does not have to be read or exported.
+    Returns None if the layer is not stored in a local file or has unsaved edits: its data should always be published.
+    """
+    stats = getLayerSourceStats(layer)
+    if stats is None:
+        return None
+    subset = layer.subsetString() if layer.type() == layer.VectorLayer else ""
+    return _hash(layer.source(), subset, layer.crs().authid(), stats)
+
+
+def fieldsFingerprint(fields):
+    """ Returns a fingerprint of the selected field names (or None if all fields are published). """
+    return _hash(sorted(fields) if fields is not None else None)
+
+
+def styleFingerprint(zip_filename):
+    """ Returns a fingerprint of the contents of a zipped style (ignoring the timestamps in the ZIP file). """
+    h = hashlib.sha1()
+    with zipfile.ZipFile(zip_filename) as z:
+        for name in sorted(z.namelist()):
+            h.update(name.encode("utf-8"))
+            h.update(z.read(name))
+    return h.hexdigest()
+
+
+def metadataFingerprint(layer, *args):
+    """ Returns a fingerprint of the layer metadata and any additional values (e.g. service URLs) that end up in it. """
+    doc = QDomDocument()
+    root = doc.createElement("metadata")
+    layer.metadata().writeMetadataXml(root, doc)
+    doc.appendChild(root)
+    return _hash(doc.toString(), args)
+
+
+class PublishManifest:
+    """
+    Keeps track of the content fingerprints of all layers that were published to a server workspace.
+    The manifest is stored as a JSON file in the QGIS profile folder, so that a next (incremental)
+    publication can skip all layers (or layer parts) that did not change.
+    """
+
+    def __init__(self, server_name, scope):
+        self.server_name = server_name
+        self.scope = scope
+        self._entries = {}
+        self._lock = RLock()
+        self.load()
+
+    @classmethod
+    def forServers(cls, geodata_server, metadata_server):
+        """
+        Returns the manifest for the given servers: if there is a geodata server, the manifest is kept per workspace.
+        Otherwise, the manifest is kept per metadata server and QGIS project.
+        """
+        if geodata_server is not None:
+            server = geodata_server
+            scope = getattr(geodata_server, "workspace", None)
+        else:
+            server = metadata_server
+            scope = None
+        if not scope:
+            scope = os.path.splitext(os.path.basename(QgsProject().instance().fileName()))[0]
+        return cls(server.name, scope)
+
+    @property
+    def filename(self):
+        folder = os.path.join(QgsApplication.qgisSettingsDirPath(), meta.PLUGIN_NAMESPACE, "manifests")
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, "%s.json" % _hash(self.server_name, self.scope))
+
+    def load(self):
+        with self._lock:
+            try:
+                with open(self.filename, encoding="utf8") as f:
+                    self._entries = json.load(f).get("layers", {})
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def save(self):
+        with self._lock:
+            content = {"server": self.server_name, "scope": self.scope, "layers": self._entries}
+            with open(self.filename, "w", encoding="utf8") as f:
+                json.dump(content, f, indent=2)
+
+    def names(self):
+        """ Returns the names of all layers in the manifest. """
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, name, kind):
+        with self._lock:
+            return self._entries.get(name, {}).get(kind)
+
+    def isUnchanged(self, name, **fingerprints):
+        """
+        Returns True if all the given fingerprints (e.g. data=..., fields=...) match the stored ones.
+        A fingerprint of None (i.e. unknown) never matches.
+        """
+        with self._lock:
+            entry = self._entries.get(name, {})
+            return all(value is not None and entry.get(kind) == value for kind, value in fingerprints.items())
+
+    def update(self, name, **fingerprints):
+        with self._lock:
+            self._entries.setdefault(name, {}).update(fingerprints)
+
+    def discard(self, name, *kinds):
+        """ Removes the given fingerprint kinds for a layer, or the complete layer entry if no kinds are given. """
+        with self._lock:
+            if not kinds:
+                self._entries.pop(name, None)
+                return
+            entry = self._entries.get(name, {})
+            for kind in kinds:
+                entry.pop(kind, None)
@@ -42,16 +42,20 @@ class MapserverServer(ServerBase):
         self.publishStyle(layer)
         layerFilename = layer.name() + ".shp"
         layerPath = os.path.join(self.dataFolder(), layerFilename)
-        exportLayer(layer, fields, toShapefile=True, path=layerPath, force=True, log=self)
+        exportLayer(layer, fields, to_shapefile=True, path=layerPath, force=True, logger=self)
 
     def uploadFolder(self, folder):
         username, password = self.getCredentials()
-        uploadFolder(folder, self.host, self.port, self.folder, username, password)
+        progress = getattr(self._threadState, "progress", None)
+        uploaded, skipped = uploadFolder(folder, self.host, self.port, self.folder, username, password,
+                                         progress=progress, canceled=self.isCanceled)
+        self.logInfo(f"Uploaded {uploaded} file(s) to FTP server '{self.host}' ({skipped} unchanged file(s) skipped)")
 
     def testConnection(self):
         return True
 
-    def prepareForPublishing(self, onlySymbology):
+    def prepareForPublishing(self, onlySymbology, manifest=None):
+        # The map file is always regenerated for all layers, so incremental publishing (manifest) is not supported
         self._layers = []
         self._metadataLinks = {}
         self._folder = self.folder if self.useLocalFolder else tempFolder()
@@ -2,22 +2,21 @@ import os
 import uuid
 import zipfile
 from datetime import datetime
-from xml.dom import minidom
+from threading import local
+from io import BytesIO
 from xml.etree import ElementTree
-from xml.etree.ElementTree import Element, SubElement
 
 import lxml.etree as ET
-from qgis.PyQt.QtCore import QSize
-from qgis.PyQt.QtGui import QImage, QColor, QPainter
+from qgis.PyQt.QtXml import QDomDocument
 from qgis.core import (
-    QgsMapSettings,
-    QgsMapRendererCustomPainterJob,
     Qgis,
     QgsMessageLog
 )
 
+from ..utils import meta
 from ..utils.files import tempFilenameInTempFolder, getResourcePath
 from ..utils.layers import getLayerTitleAndName
+from .thumbnails import layerThumbnail
 
 QMD_TO_ISO19139_XSLT = getResourcePath("qgis-to-iso19139.xsl")
 ISO19139_TO_QMD_XSLT = getResourcePath("iso19139-to-qgis.xsl")
@@ -26,10 +25,28 @@ WRAPPING_ISO19115_TO_ISO19139_XSLT = getResourcePath("ISO19115-wrapping-MD_Metad
 FGDC_TO_ISO19115 = getResourcePath("ArcCatalogFgdc_to_ISO19115.xsl")
 
 
+#: Compiled XSLT transforms by (path, modification time), per thread (lxml XSLT objects are bound to a thread)
+_xsltCache = local()
+
+
+def _getTransform(xslt_file):
+    """
+    Returns the compiled XSLT transform for the given stylesheet.
+    Stylesheets are compiled once per thread and recompiled if the file was modified.
+    """
+    cache = getattr(_xsltCache, "transforms", None)
+    if cache is None:
+        cache = _xsltCache.transforms = {}
+    mtime = os.path.getmtime(xslt_file)
+    cached = cache.get(xslt_file)
+    if cached is None or cached[0] != mtime:
+        cached = cache[xslt_file] = mtime, ET.XSLT(ET.parse(xslt_file))
+    return cached[1]
+
+
 def _transformDom(input_file, xslt_file):
     in_dom = ET.parse(input_file)
-    xslt = ET.parse(xslt_file)
-    transform = ET.XSLT(xslt)
+    transform = _getTransform(xslt_file)
     out_dom = transform(in_dom)
     if not out_dom:
         raise Exception("Failed to convert metadata")
@@ -76,28 +93,17 @@ def _loadMetadataFromFgdcXml(layer, filename):
     _loadMetadataFromEsriXml(layer, iso_filename)
 
 
-def _saveLayerThumbnail(layer):
-    filename = tempFilenameInTempFolder("thumbnail.png")
-    img = QImage(QSize(800, 800), QImage.Format_A2BGR30_Premultiplied)
-    color = QColor(255, 255, 255, 255)
-    img.fill(color.rgba())
-    p = QPainter()
-    p.begin(img)
-    p.setRenderHint(QPainter.Antialiasing)
-    ms = QgsMapSettings()
-    ms.setBackgroundColor(color)
-    ms.setLayers([layer])
-    ms.setExtent(layer.extent())
-    ms.setOutputSize(img.size())
-    render = QgsMapRendererCustomPainterJob(ms, p)
-    render.start()
-    render.waitForFinished()
-    p.end()
-    img.save(filename)
-    return filename
-
-
-def _transformMetadata(filename, uuid, api_url, wms, wfs, layer_name):
+def _layerMetadataDom(layer):
+    """ Returns the QGIS metadata of the layer as an lxml tree (the same document as a .qmd file). """
+    doc = QDomDocument("qgis")
+    root = doc.createElement("qgis")
+    root.setAttribute("version", Qgis.version())
+    doc.appendChild(root)
+    layer.metadata().writeMetadataXml(root, doc)
+    return ET.ElementTree(ET.fromstring(doc.toByteArray().data()))
+
+
+def _transformMetadata(qmd_dom, uuid, api_url, wms, wfs, layer_name, thumbnail_name):
 
     def _ns(n):
         return f"{{http://www.isotc211.org/2005/gmd}}{n}"
@@ -117,8 +123,9 @@ def _transformMetadata(filename, uuid, api_url, wms, wfs, layer_name):
         csname = ET.SubElement(name, "{http://www.isotc211.org/2005/gco}CharacterString")
         csname.text = md_layer
 
-    iso_filename = tempFilenameInTempFolder("metadata.xml")
-    out_dom = _transformDom(filename, iso_filename)
+    out_dom = _getTransform(QMD_TO_ISO19139_XSLT)(qmd_dom)
+    if not out_dom:
+        raise Exception("Failed to convert metadata")
 
     for ident in out_dom.iter(_ns("fileIdentifier")):
         ident[0].text = uuid
@@ -133,31 +140,32 @@ def _transformMetadata(filename, uuid, api_url, wms, wfs, layer_name):
         browse_graphic = ET.SubElement(overview, _ns("MD_BrowseGraphic"))
         file = ET.SubElement(browse_graphic, _ns("fileName"))
         cs = ET.SubElement(file, "{http://www.isotc211.org/2005/gco}CharacterString")
-        thumbnail_url = f"{api_url}/records/{uuid}/attachments/thumbnail.png"
+        thumbnail_url = f"{api_url}/records/{uuid}/attachments/{thumbnail_name}"
         cs.text = thumbnail_url
 
-    _writeDom(out_dom, iso_filename)
-    return iso_filename
+    return out_dom
 
 
-def _createMef(uuid, md_filename, mef_filename, thumb_filename):
-    z = zipfile.ZipFile(mef_filename, "w")
-    z.write(md_filename, os.path.join(uuid, "metadata", os.path.basename(md_filename)))
-    z.write(thumb_filename, os.path.join(uuid, "public", os.path.basename(thumb_filename)))
-    info = _getInfoXmlContent(uuid, thumb_filename)
-    z.writestr(os.path.join(uuid, "info.xml"), info)
-    z.close()
+def _createMef(uuid, md_dom, thumbnail_name, thumbnail):
+    """ Returns the bytes of a MEF (ZIP) file with the given metadata tree and thumbnail image. """
+    md_bytes = ET.tostring(md_dom, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        z.writestr(f"{uuid}/metadata/metadata.xml", md_bytes)
+        z.writestr(f"{uuid}/public/{thumbnail_name}", thumbnail)
+        z.writestr(f"{uuid}/info.xml", _getInfoXmlContent(uuid, thumbnail_name))
+    return buffer.getvalue()
 
 
 def _addSubElement(parent, tag, value=None, attrib=None):
-    sub = SubElement(parent, tag, attrib=attrib or {})
+    sub = ET.SubElement(parent, tag, attrib=attrib or {})
     if value is not None:
         sub.text = value
     return sub
 
 
 def _getInfoXmlContent(uuid, thumb_filename):
-    root = Element("info", {"version": "1.1"})
+    root = ET.Element("info", {"version": "1.1"})
     general = _addSubElement(root, "general")
     d = datetime.now().isoformat()
     _addSubElement(general, "changeDate", d)
@@ -179,11 +187,9 @@ def _getInfoXmlContent(uuid, thumb_filename):
     public = _addSubElement(root, "public")
     _addSubElement(public, "file", attrib={"name": os.path.basename(thumb_filename), "changeDate": d})
     _addSubElement(root, "private")
-    xmlstring = ElementTree.tostring(root, encoding="UTF-8", method="xml").decode()
-    dom = minidom.parseString(xmlstring)
-    return dom.toprettyxml(indent="  ")
+    return ET.tostring(root, pretty_print=True, xml_declaration=True, encoding="UTF-8")
+
 
-  
 def uuidForLayer(layer):
     return str(uuid.uuid5(uuid.NAMESPACE_DNS, layer.source()))
 
@@ -213,15 +219,21 @@ def loadMetadataFromXml(layer, filename):
         _loadMetadataFromFgdcXml(layer, filename)
 
 
-def saveMetadata(layer, mefFilename=None, apiUrl=None, wms=None, wfs=None, layerName=None):
+def metadataAsMef(layer, apiUrl=None, wms=None, wfs=None, layerName=None):
+    """
+    Converts the layer metadata to ISO19139 and returns it as MEF (ZIP) file content (bytes),
+    including a thumbnail of the layer. Everything is processed in memory.
+    """
     uuid = uuidForLayer(layer)
     _, safe_name = getLayerTitleAndName(layer)
-    filename = tempFilenameInTempFolder(safe_name + ".qmd")
-    layer.saveNamedMetadata(filename)
-    thumbnail = _saveLayerThumbnail(layer)
-    apiUrl = apiUrl or ""
-    transformedFilename = _transformMetadata(filename, uuid, apiUrl, wms, wfs, layerName or safe_name)
-    mefFilename = mefFilename or tempFilenameInTempFolder(uuid + ".mef")
-    _createMef(uuid, transformedFilename, mefFilename, thumbnail)
+    thumbnail_name, thumbnail = layerThumbnail(layer)
+    md_dom = _transformMetadata(_layerMetadataDom(layer), uuid, apiUrl or "", wms, wfs, layerName or safe_name,
+                                thumbnail_name)
+    return _createMef(uuid, md_dom, thumbnail_name, thumbnail)
+
+
+def saveMetadata(layer, mefFilename=None, apiUrl=None, wms=None, wfs=None, layerName=None):
+    mefFilename = mefFilename or tempFilenameInTempFolder(uuidForLayer(layer) + ".mef")
+    with open(mefFilename, "wb") as f:
+        f.write(metadataAsMef(layer, apiUrl, wms, wfs, layerName))
     return mefFilename
-  
\ No newline at end of file
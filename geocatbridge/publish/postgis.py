@@ -1,8 +1,48 @@
+import io
+import time
+
 import psycopg2
-from qgis.core import QgsVectorLayerExporter, QgsFeatureSink, QgsFields
-from qgis.PyQt.QtCore import QCoreApplication
+from psycopg2 import sql
+from qgis.core import QgsFeatureRequest, QgsWkbTypes
+from qgis.PyQt.QtCore import QCoreApplication, QVariant, QDate, QDateTime, QTime, Qt
 from .serverbase import ServerBase
 
+#: Default number of features that are sent to the database per COPY statement
+DEFAULT_IMPORT_BATCH_SIZE = 10000
+#: Names of the primary key and geometry columns of imported tables
+KEY_COLUMN = "id"
+GEOMETRY_COLUMN = "geom"
+
+_NULL = "\\N"
+_COLUMN_TYPES = {
+    QVariant.Int: "integer",
+    QVariant.UInt: "bigint",
+    QVariant.LongLong: "bigint",
+    QVariant.ULongLong: "numeric",
+    QVariant.Double: "double precision",
+    QVariant.Bool: "boolean",
+    QVariant.Date: "date",
+    QVariant.DateTime: "timestamp",
+    QVariant.Time: "time",
+}
+
+
+def _columnType(field):
+    """ Returns the PostgreSQL column type for a QgsField (text for unsupported types). """
+    return _COLUMN_TYPES.get(field.type(), "text")
+
+
+def _copyValue(value):
+    """ Returns an attribute value formatted (and escaped) for the PostgreSQL COPY text format. """
+    if value is None or (isinstance(value, QVariant) and value.isNull()):
+        return _NULL
+    if isinstance(value, (QDate, QDateTime, QTime)):
+        return value.toString(Qt.ISODate) if value.isValid() else _NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
 class PostgisServer(ServerBase): 
     
     def __init__(self, name, authid="", host="localhost", port="5432", schema="public", database="db"):
@@ -16,28 +56,110 @@ class PostgisServer(ServerBase):
         self._isMetadataCatalog = False
         self._isDataCatalog = False
 
-    def importLayer(self, layer, fields):
+    def _connect(self):
         username, password = self.getCredentials()
-        uri = "dbname='%s' key='id' host=%s port=%s user='%s' password='%s' table=\"%s\".\"%s\" (geom) sql=" % (self.database, 
-                    self.host, self.port, username, password, self.schema, layer.name())
-        
-        qgsfields = QgsFields()
-        for f in layer.fields():
-            if fields is None or f.name() in fields:
-                qgsfields.append(f)
-        exporter = QgsVectorLayerExporter(uri, "postgres", qgsfields,
-                                          layer.wkbType(), layer.sourceCrs(), True)
-
-        if exporter.errorCode() != QgsVectorLayerExporter.NoError:
-            raise Exception(QCoreApplication.translate("GeoCat Bridge", 'Error importing to PostGIS: {0}').format(exporter.errorMessage()))
-
-        features = layer.getFeatures()
-        for f in features:
-            if not exporter.addFeature(f, QgsFeatureSink.FastInsert):
-                raise Exception(QCoreApplication.translate("GeoCat Bridge", 'Error importing to PostGIS: {0}').format(exporter.errorMessage()))
-        exporter.flushBuffer()
-        if exporter.errorCode() != QgsVectorLayerExporter.NoError:
-            raise Exception(QCoreApplication.translate("GeoCat Bridge", 'Error importing to PostGIS: {0}').format(exporter.errorMessage()))
+        return psycopg2.connect(dbname=self.database, user=username, password=password,
+                                host=self.host, port=self.port)
+
+    def importLayer(self, layer, fields, batch_size=DEFAULT_IMPORT_BATCH_SIZE, progress=None, canceled=None):
+        """
+        Imports a vector layer into a (new or overwritten) table with the layer name, using PostgreSQL COPY.
+        Features are streamed in batches of `batch_size`, so that memory use stays low for large layers.
+        A spatial index is created and the table is analyzed after the load.
+
+        :param layer:       The vector layer to import.
+        :param fields:      The names of the fields to import, or None to import all fields.
+        :param batch_size:  The number of features sent per COPY statement.
+        :param progress:    Optional function that is called with (imported_features, total_features).
+        :param canceled:    Optional function that returns True if the import should be aborted.
+        :returns:           True if the layer was imported, False if the import was canceled.
+        """
+        qgsfields = [f for f in layer.fields() if fields is None or f.name() in fields]
+        indices = [layer.fields().indexFromName(f.name()) for f in qgsfields]
+        names = [f.name() for f in qgsfields]
+        srid = layer.crs().postgisSrid()
+        wkb_type = layer.wkbType()
+        geom_type = QgsWkbTypes.displayString(QgsWkbTypes.flatType(wkb_type))
+        if QgsWkbTypes.flatType(wkb_type) in (QgsWkbTypes.Unknown, QgsWkbTypes.NoGeometry):
+            geom_type = "Geometry"
+        elif QgsWkbTypes.hasZ(wkb_type):
+            geom_type += "Z"
+        if QgsWkbTypes.hasM(wkb_type):
+            geom_type += "M"
+        force_multi = QgsWkbTypes.isMultiType(wkb_type)
+
+        table = sql.Identifier(self.schema, layer.name())
+        columns = [sql.SQL("{} {}").format(sql.Identifier(f.name()), sql.SQL(_columnType(f))) for f in qgsfields]
+        if KEY_COLUMN not in names:
+            columns.insert(0, sql.SQL("{} bigserial PRIMARY KEY").format(sql.Identifier(KEY_COLUMN)))
+        columns.append(sql.SQL("{} geometry({}, {})").format(sql.Identifier(GEOMETRY_COLUMN),
+                                                            sql.SQL(geom_type), sql.Literal(srid)))
+        copy_sql = sql.SQL("COPY {} ({}) FROM STDIN").format(
+            table, sql.SQL(", ").join(sql.Identifier(n) for n in names + [GEOMETRY_COLUMN]))
+
+        request = QgsFeatureRequest().setSubsetOfAttributes(indices)
+        total = layer.featureCount()
+        count = 0
+        start = time.perf_counter()
+        try:
+            con = self._connect()
+        except psycopg2.Error as e:
+            raise Exception(QCoreApplication.translate("GeoCat Bridge", 'Error importing to PostGIS: {0}').format(e))
+        try:
+            with con, con.cursor() as cur:
+                # Create the table in the same transaction as the COPY, so that PostgreSQL can skip WAL logging (if wal_level is minimal)
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(table))
+                cur.execute(sql.SQL("CREATE TABLE {} ({})").format(table, sql.SQL(", ").join(columns)))
+                buffer = io.StringIO()
+                rows = 0
+                for feature in layer.getFeatures(request):
+                    attrs = feature.attributes()
+                    values = [_copyValue(attrs[i]) for i in indices]
+                    geom = feature.geometry()
+                    if geom.isNull():
+                        values.append(_NULL)
+                    else:
+                        if force_multi and not geom.isMultipart():
+                            geom.convertToMultiType()
+                        values.append("SRID=%d;%s" % (srid, bytes(geom.asWkb()).hex()))
+                    buffer.write("\t".join(values) + "\n")
+                    rows += 1
+                    if rows >= batch_size:
+                        count += self._copyBatch(cur, copy_sql, buffer, rows)
+                        buffer, rows = io.StringIO(), 0
+                        if progress:
+                            progress(count, total)
+                        if canceled and canceled():
+                            con.rollback()
+                            self.logWarning(QCoreApplication.translate("GeoCat Bridge",
+                                                                       "Import of layer '{0}' to PostGIS was canceled")
+                                            .format(layer.name()))
+                            return False
+                count += self._copyBatch(cur, copy_sql, buffer, rows)
+                if progress:
+                    progress(count, total)
+                load_time = time.perf_counter() - start
+                cur.execute(sql.SQL("CREATE INDEX ON {} USING GIST ({})").format(
+                    table, sql.Identifier(GEOMETRY_COLUMN)))
+                cur.execute(sql.SQL("ANALYZE {}").format(table))
+        except psycopg2.Error as e:
+            raise Exception(QCoreApplication.translate("GeoCat Bridge", 'Error importing to PostGIS: {0}').format(e))
+        finally:
+            con.close()
+
+        rate = count / load_time if load_time else count
+        self.logInfo(QCoreApplication.translate("GeoCat Bridge",
+                                                "Imported {0} features into {1}.{2} in {3:.1f} s ({4:.0f} features/s)")
+                     .format(count, self.schema, layer.name(), load_time, rate))
+        return True
+
+    @staticmethod
+    def _copyBatch(cursor, copy_sql, buffer, rows):
+        """ Sends the rows in the (text) buffer to the database using COPY and returns the number of rows sent. """
+        if rows:
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+        return rows
 
     def testConnection(self):
         username, password = self.getCredentials()
@@ -2,6 +2,9 @@ import os
 import string
 import sys
 import traceback
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from queue import Queue, Empty
 
 from qgis.PyQt.QtCore import pyqtSignal
 from qgis.core import (
@@ -17,13 +20,23 @@ from qgis.core import (
     QgsCoordinateReferenceSystem
 )
 
-from bridgestyle.qgis import saveLayerStyleAsZippedSld
 from .exporter import exportLayer
+from .manifest import PublishManifest, metadataFingerprint
 from .metadata import uuidForLayer, saveMetadata
+from .serverbase import RequestCanceled
 from ..ui.progressdialog import DATA, METADATA, SYMBOLOGY, GROUPS
 from ..ui.publishreportdialog import PublishReportDialog
 from ..utils.feedback import FeedbackMixin
-from ..utils import layers as layerUtils
+from ..utils import layers as layerUtils, meta
+from ..utils.styles import saveLayerStyleAsZippedSld
+
+
+def layersByName(layers):
+    """ Returns a dictionary of {layer name: layer}. If multiple layers have the same name, the first one is used. """
+    index = {}
+    for layer in layers:
+        index.setdefault(layer.name(), layer)
+    return index
 
 
 class PublishTask(QgsTask):
@@ -31,7 +44,18 @@ class PublishTask(QgsTask):
     stepStarted = pyqtSignal(str, int)
     stepSkipped = pyqtSignal(str, int)
 
-    def __init__(self, layers, fields, only_symbology, geodata_server, metadata_server, parent):
+    # DONOTALLOW = 0
+    ALLOW = 1
+    ALLOWONLYDATA = 2
+
+    #: Maximum number of worker threads that publish layers simultaneously.
+    #: The number of simultaneous jobs per server is further limited by the server itself.
+    MAX_WORKERS = meta.PUBLISH_WORKERS
+
+    #: Warning reported for layers of which the publication was (partially) canceled
+    CANCELED_WARNING = "Publication was canceled"
+
+    def __init__(self, layers, fields, only_symbology, geodata_server, metadata_server, parent, incremental=False):
         super().__init__("Publish from GeoCat Bridge", QgsTask.CanCancel)
         self.results = {}
         self.exception = None
@@ -40,8 +64,14 @@ class PublishTask(QgsTask):
         self.geodata_server = geodata_server
         self.metadata_server = metadata_server
         self.only_symbology = only_symbology
+        self.incremental = incremental
+        self.manifest = None
         self.fields = fields
         self.parent = parent
+        self._steps = Queue()
+        self._uploadProgress = {}
+        self._metadataRecords = {}
+        self._layerIndex = None
 
     @staticmethod
     def _layerGroups(to_publish):
@@ -79,10 +109,10 @@ class PublishTask(QgsTask):
         return groups
 
     def layerFromName(self, name):
-        layers = self.publishableLayers()
-        for layer in layers:
-            if layer.name() == name:
-                return layer
+        # The name index is built only once per task, instead of scanning all project layers for every name
+        if self._layerIndex is None:
+            self._layerIndex = layersByName(self.publishableLayers())
+        return self._layerIndex.get(name)
 
     @staticmethod
     def publishableLayers():
@@ -90,116 +120,258 @@ class PublishTask(QgsTask):
                   if layer.type() in [QgsMapLayer.VectorLayer, QgsMapLayer.RasterLayer]]
         return layers
 
-    def run(self):
-
-        def publishLayer(lyr, lyr_name):
-            fields = None
-            if lyr.type() == lyr.VectorLayer:
-                fields = [_name for _name, publish in self.fields[lyr].items() if publish]
-            self.geodata_server.publishLayer(lyr, fields)
-            if self.metadata_server is not None:
-                metadata_uuid = uuidForLayer(lyr)
-                md_url = self.metadata_server.metadataUrl(metadata_uuid)
-                self.geodata_server.setLayerMetadataLink(lyr_name, md_url)
+    def _queueStep(self, signal, name, category):
+        """ Queues a step signal from a worker thread, so that it can be emitted in order by `run`. """
+        self._steps.put((signal, name, category))
+
+    def _emitQueuedSteps(self):
+        """ Emits all queued step signals (in the order in which they were queued) from the thread running `run`. """
+        while True:
+            try:
+                signal, name, category = self._steps.get_nowait()
+            except Empty:
+                return
+            signal.emit(name, category)
+
+    def _setUploadProgress(self, name, sent, total):
+        """ Stores the upload progress (fraction) of the layer with the given name. Called from worker threads. """
+        self._uploadProgress[name] = sent / total if total else 1
+
+    def _setSharedUploadProgress(self, sent, total):
+        """ Reports the upload progress of data that is shared by all layers (e.g. a single datastore). """
+        self.setProgress(sent * 100 / total if total else 100)
+
+    def _logException(self, warnings, errors):
+        """ Adds the current exception to the errors, or a warning if it was raised because the task was canceled. """
+        if self.isCanceled() or sys.exc_info()[0] is RequestCanceled:
+            warnings.append(self.CANCELED_WARNING)
+        else:
+            errors.append(traceback.format_exc())
+
+    def _layerFields(self, layer):
+        """ Returns the names of the fields to publish for a vector layer, or None for a raster layer. """
+        if layer.type() == layer.VectorLayer:
+            return [_name for _name, publish in self.fields[layer].items() if publish]
+        return None
+
+    def _publishData(self, layer, name, safe_name, md_valid, allow_without_md):
+        """ Publishes the style and data of a single layer. Runs in a worker thread. """
+        warnings, errors = [], []
+        if self.isCanceled():
+            return [self.CANCELED_WARNING], errors
+
+        fields = self._layerFields(layer)
+
+        # The log is kept per thread: reset it before the export, so that issues logged while exporting are reported
+        self.geodata_server.resetLog()
+
+        # Export the data before acquiring a server slot, so that exports run ahead of the uploads
+        if not self.only_symbology:
+            try:
+                self.geodata_server.exportLayerData(layer, fields)
+            except Exception:
+                self._logException(warnings, errors)
+
+        with self.geodata_server.slots:
+            self.geodata_server.setUploadProgressCallback(partial(self._setUploadProgress, name))
+            self.geodata_server.setCancelCallback(self.isCanceled)
+
+            # Publish style
+            self._queueStep(self.stepStarted, name, SYMBOLOGY)
+            try:
+                self.geodata_server.publishStyle(layer)
+            except Exception:
+                self._logException(warnings, errors)
+            self._queueStep(self.stepFinished, name, SYMBOLOGY)
+
+            if self.only_symbology:
+                self._queueStep(self.stepSkipped, name, DATA)
+            elif not self.isCanceled():
+                # Publish data
+                self._queueStep(self.stepStarted, name, DATA)
+                try:
+                    if md_valid or allow_without_md in (self.ALLOW, self.ALLOWONLYDATA):
+                        self.geodata_server.publishLayer(layer, fields)
+                        if self.metadata_server is not None:
+                            md_url = self.metadata_server.metadataUrl(uuidForLayer(layer))
+                            self.geodata_server.setLayerMetadataLink(safe_name, md_url)
+                    else:
+                        self.geodata_server.logError(f"Layer '{name}' has invalid metadata. "
+                                                     f"Layer was not published")
+                except Exception:
+                    self._logException(warnings, errors)
+                self._queueStep(self.stepFinished, name, DATA)
+            else:
+                warnings.append(self.CANCELED_WARNING)
+
+            self.geodata_server.setUploadProgressCallback(None)
+            self.geodata_server.setCancelCallback(None)
+            self._uploadProgress.pop(name, None)
+            w, e = self.geodata_server.getLogIssues()
+            warnings.extend(w)
+            errors.extend(e)
+        return warnings, errors
+
+    def _publishMetadata(self, layer, name, safe_name, md_valid, allow_without_md):
+        """ Publishes the metadata of a single layer. Runs in a worker thread, in parallel with the data. """
+        warnings, errors = [], []
+        if self.isCanceled():
+            return [self.CANCELED_WARNING], errors
+
+        with self.metadata_server.slots:
+            self.metadata_server.resetLog()
+            self.metadata_server.setCancelCallback(self.isCanceled)
+            try:
+                if md_valid or allow_without_md == self.ALLOW:
+                    wms = None
+                    wfs = None
+                    full_name = None
+                    if self.geodata_server is not None:
+                        full_name = self.geodata_server.fullLayerName(safe_name)
+                        wms = self.geodata_server.layerWmsUrl()
+                        if layer.type() == layer.VectorLayer:
+                            wfs = self.geodata_server.layerWfsUrl()
+                    self._queueStep(self.stepStarted, name, METADATA)
+                    md_fp = metadataFingerprint(layer, wms, wfs, full_name)
+                    if self.manifest and self.manifest.isUnchanged(safe_name, metadata=md_fp) \
+                            and self.metadata_server.metadataExists(uuidForLayer(layer)):
+                        self.metadata_server.logInfo(f"Metadata for layer '{name}' did not change: skipping upload")
+                        self._queueStep(self.stepFinished, name, METADATA)
+                    else:
+                        # The record is uploaded later, in a single batch with the records of all other layers
+                        mef = self.metadata_server.layerMetadataAsMef(layer, wms, wfs, full_name)
+                        self._metadataRecords[name] = uuidForLayer(layer), safe_name, mef, md_fp
+                else:
+                    self.metadata_server.logError(f"Layer '{name}' has invalid metadata. "
+                                                  f"Metadata was not published")
+            except Exception:
+                self._logException(warnings, errors)
+
+            self.metadata_server.setCancelCallback(None)
+            w, e = self.metadata_server.getLogIssues()
+            warnings.extend(w)
+            errors.extend(e)
+        return warnings, errors
+
+    def _publishMetadataBatch(self):
+        """ Uploads all prepared metadata records in a single batch and returns the errors by layer name. """
+        records, self._metadataRecords = self._metadataRecords, {}
+        if not records:
+            return {}
+        try:
+            failed = self.metadata_server.publishMetadataBatch({r[0]: r[2] for r in records.values()},
+                                                               self.MAX_WORKERS)
+        except Exception:
+            failed = {r[0]: traceback.format_exc() for r in records.values()}
+        errors = {}
+        for name, (uuid, safe_name, _, md_fp) in records.items():
+            if uuid in failed:
+                errors[name] = [f"Metadata for layer '{name}' could not be published: {failed[uuid]}"]
+            elif self.manifest:
+                self.manifest.update(safe_name, metadata=md_fp)
+            self.stepFinished.emit(name, METADATA)
+        return errors
 
+    def run(self):
         try:
             validator = QgsNativeMetadataValidator()
+            allow_without_md = self.ALLOW  # pluginSetting("allowWithoutMetadata")
 
-            # DONOTALLOW = 0
-            ALLOW = 1
-            ALLOWONLYDATA = 2
-
-            allow_without_md = ALLOW  # pluginSetting("allowWithoutMetadata")
-
+            if self.incremental and (self.geodata_server or self.metadata_server):
+                self.manifest = PublishManifest.forServers(self.geodata_server, self.metadata_server)
             if self.geodata_server is not None:
-                self.geodata_server.prepareForPublishing(self.only_symbology)
+                self.geodata_server.prepareForPublishing(self.only_symbology, self.manifest)
+                if not self.only_symbology:
+                    layers = [self.layerFromName(name) for name in self.layers]
+                    self.geodata_server.setUploadProgressCallback(self._setSharedUploadProgress)
+                    self.geodata_server.setCancelCallback(self.isCanceled)
+                    try:
+                        self.geodata_server.exportLayersData([(lyr, self._layerFields(lyr)) for lyr in layers])
+                    finally:
+                        self.geodata_server.setUploadProgressCallback(None)
+                        self.geodata_server.setCancelCallback(None)
 
             qgs_layers = {}
             self.results = {}
-            for i, name in enumerate(self.layers):
-                if self.isCanceled():
-                    return False
-                warnings, errors = [], []
-                self.setProgress(i * 100 / len(self.layers))
-                layer = self.layerFromName(name)
-                qgs_layers[name] = layer
-                _, safe_name = layerUtils.getLayerTitleAndName(layer)
-                if not layerUtils.hasValidLayerName(layer):
-                    try:
-                        warnings.append(f"Layer name '{name}' contains characters that might cause issues")
-                    except UnicodeError:
-                        warnings.append("Layer name contains characters that might cause issues")
-                md_valid, _ = validator.validate(layer.metadata())
-                if self.geodata_server is not None:
-                    self.geodata_server.resetLog()
-
-                    # Publish style
-                    self.stepStarted.emit(name, SYMBOLOGY)
-                    try:
-                        self.geodata_server.publishStyle(layer)
-                    except:
-                        errors.append(traceback.format_exc())
-                    self.stepFinished.emit(name, SYMBOLOGY)
-
-                    if self.only_symbology:
+            self._steps = Queue()
+            self._metadataRecords = {}
+            jobs = {}
+            with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+                # Submit publication jobs in layer order: workers pick them up in the same order
+                for name in self.layers:
+                    layer = self.layerFromName(name)
+                    qgs_layers[name] = layer
+                    _, safe_name = layerUtils.getLayerTitleAndName(layer)
+                    warnings = []
+                    if not layerUtils.hasValidLayerName(layer):
+                        try:
+                            warnings.append(f"Layer name '{name}' contains characters that might cause issues")
+                        except UnicodeError:
+                            warnings.append("Layer name contains characters that might cause issues")
+                    md_valid, _ = validator.validate(layer.metadata())
+                    args = layer, name, safe_name, md_valid, allow_without_md
+
+                    layer_jobs = [warnings]
+                    if self.geodata_server is not None:
+                        layer_jobs.append(executor.submit(self._publishData, *args))
+                    else:
+                        self.stepSkipped.emit(name, SYMBOLOGY)
                         self.stepSkipped.emit(name, DATA)
+                    if self.metadata_server is not None:
+                        # Autofill metadata on this thread, because it modifies the layer
+                        self.autofillMetadata(layer)
+                        layer_jobs.append(executor.submit(self._publishMetadata, *args))
+                    else:
+                        self.stepSkipped.emit(name, METADATA)
+                    jobs[name] = layer_jobs
+
+                pending = {f for layer_jobs in jobs.values() for f in layer_jobs[1:]}
+                total = len(pending) or 1
+                while pending:
+                    _, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    self._emitQueuedSteps()
+                    uploading = sum(self._uploadProgress.copy().values())
+                    self.setProgress(min(total - len(pending) + uploading, total) * 100 / total)
+                    if self.isCanceled():
+                        for f in pending:
+                            f.cancel()
+                        # Running jobs abort their current request: wait for them, so their results can be reported
+                        wait(pending)
+                        break
+                self._emitQueuedSteps()
+
+            canceled = self.isCanceled()
+            if canceled:
+                # Metadata records that were prepared but not uploaded yet are reported as canceled
+                md_errors = {}
+                for name in self._metadataRecords:
+                    jobs[name][0].append(self.CANCELED_WARNING)
+                self._metadataRecords = {}
+            else:
+                md_errors = self._publishMetadataBatch()
+
+            if self.manifest:
+                if self.geodata_server is not None and not self.only_symbology and not canceled:
+                    # Only remove layers that are no longer in the project (not the ones that were unchecked)
+                    project_names = [layerUtils.getLayerTitleAndName(lyr)[1] for lyr in self.publishableLayers()]
+                    self.geodata_server.removeUnpublishedLayers(project_names)
+                self.manifest.save()
+
+            for name, (warnings, *futures) in jobs.items():
+                errors = md_errors.get(name, [])
+                for f in futures:
+                    if f.cancelled():
+                        warnings.append(self.CANCELED_WARNING)
                         continue
-
-                    # Publish data
-                    self.stepStarted.emit(name, DATA)
-                    try:
-                        if validates or allow_without_md in (ALLOW, ALLOWONLYDATA):
-                            publishLayer(layer, safe_name)
-                        else:
-                            self.stepStarted.emit(name, DATA)
-                            if validates or allow_without_md in (ALLOW, ALLOWONLYDATA):
-                                publishLayer(layer, safe_name)
-                            else:
-                                self.geodata_server.logError(f"Layer '{name}' has invalid metadata. "
-                                                             f"Layer was not published")
-                            self.stepFinished.emit(name, DATA)
-                    except:
-                        errors.append(traceback.format_exc())
-                    self.stepFinished.emit(name, DATA)
-                else:
-                    self.stepSkipped.emit(name, SYMBOLOGY)
-                    self.stepSkipped.emit(name, DATA)
-
-                if self.metadata_server is not None:
-                    try:
-                        self.metadata_server.resetLog()
-                        if md_valid or allow_without_md == ALLOW:
-                            wms = None
-                            wfs = None
-                            full_name = None
-                            if self.geodata_server is not None:
-                                full_name = self.geodata_server.fullLayerName(safe_name)
-                                wms = self.geodata_server.layerWmsUrl()
-                                if layer.type() == layer.VectorLayer:
-                                    wfs = self.geodata_server.layerWfsUrl()
-                            self.autofillMetadata(layer)
-                            self.stepStarted.emit(name, METADATA)
-                            self.metadata_server.publishLayerMetadata(layer, wms, wfs, full_name)
-                            self.stepFinished.emit(name, METADATA)
-                        else:
-                            self.metadata_server.logError(f"Layer '{name}' has invalid metadata. "
-                                                          f"Metadata was not published")
-                    except:
-                        errors.append(traceback.format_exc())
-                else:
-                    self.stepSkipped.emit(name, METADATA)
-
-                if self.geodata_server is not None:
-                    w, e = self.geodata_server.getLogIssues()
-                    warnings.extend(w)
-                    errors.extend(e)
-                if self.metadata_server is not None:
-                    w, e = self.metadata_server.getLogIssues()
+                    w, e = f.result()
                     warnings.extend(w)
                     errors.extend(e)
                 self.results[name] = (set(warnings), set(errors))
 
-            if self.geodata_server is not None:
+            if canceled:
+                self.stepSkipped.emit(None, GROUPS)
+                return False
+            elif self.geodata_server is not None:
                 self.stepStarted.emit(None, GROUPS)
                 groups = self._layerGroups(self.layers)                            
                 try:
@@ -247,7 +419,8 @@ class PublishTask(QgsTask):
         layer.setMetadata(metadata)
 
     def finished(self, result):
-        if result:
+        # If the task was canceled, report the results of the layers that were (partially) published
+        if result or (self.isCanceled() and self.results):
             dialog = PublishReportDialog(self.results, self.only_symbology,
                                          self.geodata_server, self.metadata_server,
                                          self.parent)
@@ -268,12 +441,13 @@ class ExportTask(FeedbackMixin, QgsTask):
         self.exportMetadata = export_metadata
         self.exportSymbology = export_symbology
         self.fields = fields
+        self._layerIndex = None
 
     def layerFromName(self, name):
-        layers = self.publishableLayers()
-        for layer in layers:
-            if layer.name() == name:
-                return layer
+        # The name index is built only once per task, instead of scanning all project layers for every name
+        if self._layerIndex is None:
+            self._layerIndex = layersByName(self.publishableLayers())
+        return self._layerIndex.get(name)
 
     @staticmethod
     def publishableLayers():
@@ -317,3 +491,84 @@ class ExportTask(FeedbackMixin, QgsTask):
         except Exception:
             self.exception = traceback.format_exc()
             return False
+
+
+class PublicationStatusTask(QgsTask):
+    """
+    Checks in the background which layers have their data and/or metadata published on the given servers.
+    Results are emitted (per layer) as soon as they are known.
+    """
+    connectionTested = pyqtSignal(int, bool)
+    dataStatus = pyqtSignal(str, bool)
+    metadataStatus = pyqtSignal(str, bool)
+
+    #: Maximum number of worker threads that probe the servers simultaneously
+    MAX_WORKERS = 8
+
+    def __init__(self, layer_uuids, geodata_server, metadata_server):
+        """
+        :param layer_uuids:     Dictionary of {layer name: metadata UUID} for all layers to check.
+        :param geodata_server:  The server on which to look for published layer data (or None).
+        :param metadata_server: The catalog in which to look for published metadata (or None).
+        """
+        super().__init__("Check publication status in GeoCat Bridge", QgsTask.CanCancel)
+        self.layer_uuids = layer_uuids
+        self.geodata_server = geodata_server
+        self.metadata_server = metadata_server
+        self.exception = None
+
+    def _isDataOnServer(self, name):
+        try:
+            return self.geodata_server.layerExists(name)
+        except Exception:
+            return False
+
+    def _checkData(self, executor):
+        if not self.geodata_server.testConnection():
+            self.connectionTested.emit(DATA, False)
+            return
+        self.connectionTested.emit(DATA, True)
+        names = list(self.layer_uuids)
+        if not names:
+            return
+        # Probe the first layer on its own, so that the server can load its layer index only once
+        self.dataStatus.emit(names[0], self._isDataOnServer(names[0]))
+        futures = {executor.submit(self._isDataOnServer, name): name for name in names[1:]}
+        for future in as_completed(futures):
+            if self.isCanceled():
+                return
+            self.dataStatus.emit(futures[future], future.result())
+
+    def _checkMetadata(self, executor):
+        if not self.metadata_server.testConnection():
+            self.connectionTested.emit(METADATA, False)
+            return
+        self.connectionTested.emit(METADATA, True)
+        try:
+            existing = self.metadata_server.existingMetadata(self.layer_uuids.values())
+        except Exception:
+            # Batched search is not supported: check every record separately
+            futures = {executor.submit(self.metadata_server.metadataExists, uuid): name
+                       for name, uuid in self.layer_uuids.items()}
+            for future in as_completed(futures):
+                if self.isCanceled():
+                    return
+                self.metadataStatus.emit(futures[future], future.result())
+            return
+        for name, uuid in self.layer_uuids.items():
+            self.metadataStatus.emit(name, uuid in existing)
+
+    def run(self):
+        try:
+            with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+                checks = []
+                if self.geodata_server is not None:
+                    checks.append(executor.submit(self._checkData, executor))
+                if self.metadata_server is not None:
+                    checks.append(executor.submit(self._checkMetadata, executor))
+                for check in checks:
+                    check.result()
+            return not self.isCanceled()
+        except Exception:
+            self.exception = traceback.format_exc()
+            return False
@@ -1,5 +1,9 @@
+import os
 import requests
 import json
+from threading import Lock, BoundedSemaphore, local
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from qgis.core import (
     QgsMessageLog,
@@ -8,18 +12,128 @@ from qgis.core import (
     QgsApplication
 )
 
+#: Default maximum number of pooled (keep-alive) connections per host
+DEFAULT_POOL_SIZE = 10
+#: Default number of retries for failed connections or gateway errors
+DEFAULT_MAX_RETRIES = 3
+#: Default backoff factor (in seconds) between retries
+DEFAULT_BACKOFF_FACTOR = 0.5
+#: Default (connect, read) timeout in seconds for each request
+DEFAULT_TIMEOUT = (10, 300)
+#: HTTP status codes that trigger a retry
+RETRY_STATUS_CODES = (502, 503, 504)
+#: Default maximum number of layers that are published to the same server simultaneously
+DEFAULT_CONCURRENCY = 2
+
+#: Chunk size in bytes used when streaming file uploads
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_credentialsCache = {}
+_credentialsLock = Lock()
+_authSignalConnected = False
+
+
+def _loadCredentials(authid):
+    """
+    Returns a (username, password) tuple for the given QGIS authentication configuration ID.
+    Credentials are read from the QGIS auth DB only once per `authid` and cached afterwards,
+    until the auth DB changes or `clearCredentialsCache` is called.
+    """
+    global _authSignalConnected
+    with _credentialsLock:
+        if authid in _credentialsCache:
+            return _credentialsCache[authid]
+        auth_manager = QgsApplication.authManager()
+        if not _authSignalConnected:
+            auth_manager.authDatabaseChanged.connect(clearCredentialsCache)
+            _authSignalConnected = True
+        authConfig = QgsAuthMethodConfig()
+        loaded = auth_manager.loadAuthenticationConfig(authid, authConfig, True)
+        credentials = authConfig.config('username'), authConfig.config('password')
+        if loaded:
+            # Do not cache failed lookups (e.g. master password not set yet)
+            _credentialsCache[authid] = credentials
+        return credentials
+
+
+def clearCredentialsCache(authid=None):
+    """ Removes the cached credentials for the given `authid`, or all cached credentials if not specified. """
+    with _credentialsLock:
+        if authid is None:
+            _credentialsCache.clear()
+        else:
+            _credentialsCache.pop(authid, None)
+
+
+class RequestCanceled(Exception):
+    """ Raised when a request (or an upload in progress) is aborted because the operation was canceled. """
+    pass
+
+
+class UploadStream:
+    """
+    File-like wrapper that streams an open binary file in chunks (instead of reading it into memory)
+    and reports the number of bytes sent so far to an optional progress callback.
+    If a `canceled` function is given and it returns True, the upload is aborted before the next chunk is sent.
+    The stream can be rewound, so that `requests` can retry the upload.
+    """
+
+    def __init__(self, fileobj, callback=None, chunk_size=UPLOAD_CHUNK_SIZE, canceled=None):
+        self._file = fileobj
+        self._size = os.fstat(fileobj.fileno()).st_size
+        self._callback = callback
+        self._chunkSize = chunk_size
+        self._canceled = canceled
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._chunkSize:
+            size = self._chunkSize
+        if self._canceled and self._canceled():
+            raise RequestCanceled("Upload was canceled")
+        chunk = self._file.read(size)
+        if self._callback:
+            self._callback(self._file.tell(), self._size)
+        return chunk
+
+    def tell(self):
+        return self._file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
 
 class ServerBase:
 
     def __init__(self):
-        self._warnings = []
-        self._errors = []
+        self._threadState = local()
+        self._slots = BoundedSemaphore(DEFAULT_CONCURRENCY)
         self._username = None
         self._password = None
+        self._session = None
+        self._poolSize = DEFAULT_POOL_SIZE
+        self._maxRetries = DEFAULT_MAX_RETRIES
+        self._backoffFactor = DEFAULT_BACKOFF_FACTOR
+        self._timeout = DEFAULT_TIMEOUT
 
     def logInfo(self, text):
         QgsMessageLog.logMessage(text, 'GeoCat Bridge', level=Qgis.Info)
 
+    @property
+    def _warnings(self):
+        # Warnings and errors are kept per thread, so that layers published concurrently do not mix up issues
+        if not hasattr(self._threadState, "warnings"):
+            self._threadState.warnings = []
+        return self._threadState.warnings
+
+    @property
+    def _errors(self):
+        if not hasattr(self._threadState, "errors"):
+            self._threadState.errors = []
+        return self._threadState.errors
+
     def logWarning(self, text):
         QgsMessageLog.logMessage(text, 'GeoCat Bridge', level=Qgis.Warning)
         self._warnings.append(text)
@@ -29,37 +143,137 @@ class ServerBase:
         self._errors.append(text)
 
     def resetLog(self):
-        self._warnings = []
-        self._errors = []
+        self._threadState.warnings = []
+        self._threadState.errors = []
 
     def loggedInfo(self):
         return self._warnings, self._errors
 
+    def getLogIssues(self):
+        """ Returns a tuple of all (warnings, errors) logged by the current thread. """
+        return self.loggedInfo()
+
+    def setUploadProgressCallback(self, callback):
+        """
+        Sets a function that is called with (bytes_sent, total_bytes) while the current thread uploads a file.
+        Set to None to stop reporting progress.
+        """
+        self._threadState.progress = callback
+
+    def setCancelCallback(self, callback):
+        """
+        Sets a function (e.g. `QgsTask.isCanceled`) that long-running operations of the current thread call
+        to check if they should stop. Set to None to remove it.
+        """
+        self._threadState.canceled = callback
+
+    def isCanceled(self):
+        """ Returns True if the cancel callback of the current thread reports that the operation was canceled. """
+        callback = getattr(self._threadState, "canceled", None)
+        return bool(callback and callback())
+
+    def uploadFile(self, url, filename, method="put", headers=None):
+        """ Uploads a file by streaming it from disk in chunks, reporting progress to the upload progress callback. """
+        callback = getattr(self._threadState, "progress", None)
+        with open(filename, "rb") as f:
+            return self.request(url, UploadStream(f, callback, canceled=self.isCanceled), method, headers)
+
+    def setConcurrency(self, limit):
+        """ Sets the maximum number of layers that can be published to this server simultaneously. """
+        self._slots = BoundedSemaphore(max(1, int(limit)))
+
+    @property
+    def slots(self):
+        """ Returns the semaphore that limits the number of concurrent publication jobs for this server. """
+        return self._slots
+
+    def exportLayerData(self, layer, fields=None):
+        """
+        Prepares (exports) the layer data before it is published, so that this can run ahead of the upload.
+        Servers that do not need a separate export step do nothing and return None.
+        """
+        return None
+
+    def removeUnpublishedLayers(self, names):
+        """
+        Removes the layers that were published incrementally before, but are not in the given list of names anymore.
+        Servers that do not keep track of incrementally published layers do nothing.
+        """
+        pass
+
+    def exportLayersData(self, layers):
+        """
+        Prepares (exports) the data of all layers that will be published at once, before any layer is published.
+        This is called with a list of (layer, fields) tuples. Servers that export every layer separately do nothing.
+        """
+        pass
+
     def setBasicAuthCredentials(self, username, password):
         self._username = username
         self._password = password
+        authid = getattr(self, "authid", None)
+        if authid:
+            clearCredentialsCache(authid)
 
     def getCredentials(self):
         if self._username is None or self._password is None:
-            authConfig = QgsAuthMethodConfig()
-            QgsApplication.authManager().loadAuthenticationConfig(self.authid, authConfig, True)
-            username = authConfig.config('username')
-            password = authConfig.config('password')
-            return username, password
+            return _loadCredentials(self.authid)
         else:
             return self._username, self._password
 
-    def request(self, url, data=None, method="get", headers=None, files=None):
+    def setSessionOptions(self, pool_size=None, max_retries=None, backoff_factor=None, timeout=None):
+        """
+        Configures the pooled HTTP session used by `request`.
+        Options that are not specified keep their current value.
+        The current session (if any) is closed, so that the next request uses the new settings.
+
+        :param pool_size:       Maximum number of keep-alive connections per host.
+        :param max_retries:     Number of retries on connection errors or 502/503/504 responses.
+        :param backoff_factor:  Backoff factor (in seconds) used to compute the delay between retries.
+        :param timeout:         Default timeout in seconds, either a single value or a (connect, read) tuple.
+        """
+        if pool_size is not None:
+            self._poolSize = pool_size
+        if max_retries is not None:
+            self._maxRetries = max_retries
+        if backoff_factor is not None:
+            self._backoffFactor = backoff_factor
+        if timeout is not None:
+            self._timeout = timeout
+        self.closeSession()
+
+    @property
+    def session(self):
+        """ Returns the pooled keep-alive `requests.Session` for this server (created on first use). """
+        if self._session is None:
+            retries = Retry(total=self._maxRetries, backoff_factor=self._backoffFactor,
+                            status_forcelist=RETRY_STATUS_CODES, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=self._poolSize, pool_maxsize=self._poolSize, max_retries=retries)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def closeSession(self):
+        """ Closes the pooled HTTP session (if any) and releases all its connections. """
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def request(self, url, data=None, method="get", headers=None, files=None, timeout=None):
         headers = headers or {}
         files = files or {}
         username, password = self.getCredentials()
-        req_method = getattr(requests, method.lower())
         if isinstance(data, dict):
             # If the request contains data as a dictionary, serialize as JSON
             data = json.dumps(data)
             headers["content-type"] = "application/json"
+        if self.isCanceled():
+            raise RequestCanceled(f"{method.upper()} request to '{url}' was canceled")
         self.logInfo(f"Making {method.upper()} request to '{url}'")
-        r = req_method(url, headers=headers, files=files, data=data, auth=(username, password))
+        r = self.session.request(method.upper(), url, headers=headers, files=files, data=data,
+                                 auth=(username, password), timeout=timeout or self._timeout)
         if not isinstance(r, requests.Response):
             self.logWarning("Empty or invalid response returned!")
         r.raise_for_status()
@@ -68,7 +282,7 @@ class ServerBase:
     def addOGCServers(self):
         pass
 
-    def validateGeodataBeforePublication(self, errors, toPublish, onlySymbology):
+    def validateGeodataBeforePublication(self, errors, toPublish, onlySymbology, incremental=False):
         pass
 
     def validateMetadataBeforePublication(self, errors):
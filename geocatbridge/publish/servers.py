@@ -1,21 +1,34 @@
 import json
+from importlib import import_module
 
 from qgis.PyQt.QtCore import QSettings
 from qgis.core import QgsMessageLog, Qgis
 
-from geocatbridge.publish.geonetwork import GeonetworkServer
-from geocatbridge.publish.geoserver import GeoserverServer
-from geocatbridge.publish.mapserver import MapserverServer
-from geocatbridge.publish.postgis import PostgisServer
 from geocatbridge.utils import meta
 
 SERVERS_SETTING = f"{meta.PLUGIN_NAMESPACE}/BridgeServers"
 
-_servers = {}
+#: Server class names and the modules that define them (imported only when a server of that type is needed)
+SERVER_TYPES = {
+    "GeonetworkServer": "geocatbridge.publish.geonetwork",
+    "GeoserverServer": "geocatbridge.publish.geoserver",
+    "MapserverServer": "geocatbridge.publish.mapserver",
+    "PostgisServer": "geocatbridge.publish.postgis"
+}
+
+_servers = None
+
+
+def _registry():
+    """ Returns the server registry, reading the stored servers on first access. """
+    if _servers is None:
+        readServers()
+    return _servers
 
 
 def readServers():
     global _servers
+    _servers = {}
     value = QSettings().value(SERVERS_SETTING)
     if value is None:
         return
@@ -24,8 +37,7 @@ def readServers():
         try:
             s = serverFromDefinition(serverDef)
         except KeyError:
-            known_types = ','.join(c.__name__ for c in (GeonetworkServer, GeoserverServer,
-                                                        MapserverServer, PostgisServer))
+            known_types = ','.join(SERVER_TYPES)
             QgsMessageLog().logMessage(f"Failed to load '{serverDef[0]}' type: expected one of ({known_types})",
                                        meta.getAppName(), Qgis.Critical)
             continue
@@ -33,12 +45,13 @@ def readServers():
 
 
 def serverFromDefinition(defn):
-    return globals()[defn[0]](**defn[1])
+    clazz = getattr(import_module(SERVER_TYPES[defn[0]]), defn[0])
+    return clazz(**defn[1])
 
 
 def serversAsJsonString():
     serv_list = []
-    for s in _servers.values():
+    for s in _registry().values():
         d = {k: v for k, v in s.__dict__.items() if not k.startswith("_")}
         serv_list.append((s.__class__.__name__, d))
     return json.dumps(serv_list)
@@ -49,23 +62,24 @@ def _updateStoredServers():
 
 
 def allServers():
-    return _servers
+    return _registry()
 
 
 def addServer(server):
-    _servers[server.name] = server
+    _registry()[server.name] = server
     server.addOGCServers()
     _updateStoredServers()
 
 
 def removeServer(name):
-    del _servers[name]
+    server = _registry().pop(name)
+    server.closeSession()
     _updateStoredServers()
 
 
 def geodataServers():
-    return {name: server for name, server in _servers.items() if server._isDataCatalog}
+    return {name: server for name, server in _registry().items() if server._isDataCatalog}
 
 
 def metadataServers():
-    return {name: server for name, server in _servers.items() if server._isMetadataCatalog}
+    return {name: server for name, server in _registry().items() if server._isMetadataCatalog}
@@ -0,0 +1,135 @@
+import hashlib
+import os
+from threading import Lock
+
+from qgis.PyQt.QtCore import QSize, QSettings, QByteArray, QBuffer, QIODevice, QStandardPaths
+from qgis.PyQt.QtGui import QColor, QImageWriter
+from qgis.PyQt.QtXml import QDomDocument
+from qgis.core import QgsMapSettings, QgsMapRendererParallelJob
+
+from ..utils import meta
+from .manifest import dataFingerprint
+
+#: Default thumbnail width and height in pixels
+DEFAULT_SIZE = 800
+#: Default thumbnail image format
+DEFAULT_FORMAT = "png"
+#: Maximum number of thumbnails kept in the cache folder
+MAX_CACHED_THUMBNAILS = 1000
+
+SIZE_SETTING = f"{meta.PLUGIN_NAMESPACE}/thumbnailSize"
+FORMAT_SETTING = f"{meta.PLUGIN_NAMESPACE}/thumbnailFormat"
+
+_FORMAT_EXTENSIONS = {"png": "png", "jpg": "jpg", "jpeg": "jpg", "webp": "webp"}
+_cacheLock = Lock()
+
+
+def supportedFormats():
+    """ Returns the thumbnail image formats that are supported by the Qt installation. """
+    available = {bytes(f).decode().lower() for f in QImageWriter.supportedImageFormats()}
+    return sorted({ext for fmt, ext in _FORMAT_EXTENSIONS.items() if fmt in available})
+
+
+def thumbnailOptions():
+    """ Returns the configured (size, format) for layer thumbnails. """
+    size = QSettings().value(SIZE_SETTING, DEFAULT_SIZE, type=int)
+    fmt = QSettings().value(FORMAT_SETTING, DEFAULT_FORMAT, type=str).lower()
+    return max(16, size), _FORMAT_EXTENSIONS.get(fmt, DEFAULT_FORMAT)
+
+
+def setThumbnailOptions(size=None, fmt=None):
+    """
+    Sets the size (in pixels) and/or image format (png, jpg or webp) of layer thumbnails.
+    Options that are not specified keep their current value.
+    """
+    if size is not None:
+        QSettings().setValue(SIZE_SETTING, int(size))
+    if fmt is not None:
+        fmt = fmt.lower()
+        if _FORMAT_EXTENSIONS.get(fmt) not in supportedFormats():
+            raise ValueError(f"Unsupported thumbnail format: {fmt}")
+        QSettings().setValue(FORMAT_SETTING, fmt)
+
+
+def _cacheFolder():
+    folder = os.path.join(QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation),
+                          meta.PLUGIN_NAMESPACE, "thumbnails")
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def _styleFingerprint(layer):
+    doc = QDomDocument()
+    layer.exportNamedStyle(doc)
+    return hashlib.sha1(doc.toByteArray().data()).hexdigest()
+
+
+def _cacheKey(layer, size, ext):
+    """
+    Returns a key that changes if the layer data, style, extent or CRS changes (or the thumbnail options),
+    or None if changes to the layer data cannot be detected (the thumbnail should not be cached then).
+    """
+    data_fp = dataFingerprint(layer)
+    if data_fp is None:
+        return None
+    values = (data_fp, _styleFingerprint(layer), layer.extent().toString(), layer.crs().authid(), size, ext)
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+
+
+def _render(layer, size, ext):
+    """ Renders the layer with a parallel render job and returns the image as bytes in the given format. """
+    ms = QgsMapSettings()
+    color = QColor(255, 255, 255, 255)
+    ms.setBackgroundColor(color)
+    ms.setLayers([layer])
+    ms.setDestinationCrs(layer.crs())
+    ms.setExtent(layer.extent())
+    ms.setOutputSize(QSize(size, size))
+    job = QgsMapRendererParallelJob(ms)
+    job.start()
+    job.waitForFinished()
+    img = job.renderedImage()
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    img.save(buffer, ext.upper())
+    buffer.close()
+    return data.data()
+
+
+def _pruneCache(folder):
+    files = [os.path.join(folder, f) for f in os.listdir(folder)]
+    if len(files) <= MAX_CACHED_THUMBNAILS:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - MAX_CACHED_THUMBNAILS]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def layerThumbnail(layer):
+    """
+    Returns a (filename, bytes) tuple with a thumbnail image of the layer, using the configured size and format.
+    Thumbnails are cached on disk, so a layer is only rendered again if its data, style or extent changed.
+    """
+    size, ext = thumbnailOptions()
+    filename = f"thumbnail.{ext}"
+    key = _cacheKey(layer, size, ext)
+    if key is None:
+        return filename, _render(layer, size, ext)
+    path = os.path.join(_cacheFolder(), f"{key}.{ext}")
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        return filename, data
+    except OSError:
+        pass
+    data = _render(layer, size, ext)
+    with _cacheLock:
+        with open(path, "wb") as f:
+            f.write(data)
+        _pruneCache(os.path.dirname(path))
+    return filename, data
@@ -1,17 +1,75 @@
 import json
+from collections import OrderedDict
+from functools import partial
 
 from qgis.PyQt.Qsci import QsciScintilla, QsciLexerXML, QsciLexerJSON
+from qgis.PyQt.QtCore import QTimer
 from qgis.PyQt.QtGui import QFont, QColor, QFontMetrics
 from qgis.PyQt.QtWidgets import QVBoxLayout
-from qgis.core import QgsVectorLayer, QgsRasterLayer
+from qgis.core import QgsVectorLayer, QgsRasterLayer, QgsTask, QgsApplication
 from qgis.utils import iface
 
-from bridgestyle.qgis import layerStyleAsSld, layerStyleAsMapbox, layerStyleAsMapfile
-from bridgestyle.qgis.togeostyler import convert
 from geocatbridge.utils import gui
+from geocatbridge.utils.styles import (
+    styleRevision,
+    layerStyleAsGeostyler,
+    layerStyleAsSld,
+    layerStyleAsMapbox,
+    layerStyleAsMapfile
+)
 
 WIDGET, BASE = gui.loadUiType(__file__)
 
+GEOSTYLER, SLD, MAPBOX, MAPSERVER = "geostyler", "sld", "mapbox", "mapserver"
+FORMATS = (GEOSTYLER, SLD, MAPBOX, MAPSERVER)
+
+#: Delay (in milliseconds) after the last style change before the style is converted
+UPDATE_DELAY = 400
+#: Maximum number of (layer, style revision) conversion results that are kept
+MAX_CACHED_STYLES = 50
+
+
+def _convertStyle(layer, fmt, layer_id):
+    """
+    Converts the layer style to the given format and returns a (text, warnings) tuple.
+    Conversions go through the shared style conversion cache, so that the GeoStyler conversion is done only once.
+    """
+    if fmt == SLD:
+        sld, _, warnings = layerStyleAsSld(layer, layer_id=layer_id)
+        return sld, warnings
+    if fmt == GEOSTYLER:
+        geostyler, _, _, warnings = layerStyleAsGeostyler(layer, layer_id)
+        return json.dumps(geostyler, indent=4), warnings
+    if fmt == MAPBOX:
+        mapbox, _, warnings = layerStyleAsMapbox(layer, layer_id=layer_id)
+        return mapbox, warnings
+    mapserver, _, _, warnings = layerStyleAsMapfile(layer, layer_id=layer_id)
+    return mapserver, warnings
+
+
+class StyleConversionTask(QgsTask):
+    """
+    Converts the style of a layer (clone) to one or more formats in the background.
+    The layer is cloned on the GUI thread, so that the task never touches a layer that can be edited meanwhile.
+    """
+
+    def __init__(self, layer, formats, key):
+        super().__init__("Convert layer style in GeoCat Bridge", QgsTask.CanCancel)
+        self.key = key
+        self.layer = layer.clone()
+        self.formats = formats
+        self.results = {}
+
+    def run(self):
+        for fmt in self.formats:
+            if self.isCanceled():
+                return False
+            try:
+                self.results[fmt] = _convertStyle(self.layer, fmt, self.key[0])
+            except Exception as e:
+                self.results[fmt] = "", [f"Conversion failed: {e}"]
+        return True
+
 
 class MultistylerWidget(BASE, WIDGET):
 
@@ -39,6 +97,22 @@ class MultistylerWidget(BASE, WIDGET):
         layout.addWidget(self.txtMapserver)
         self.widgetMapserver.setLayout(layout)        
 
+        self._editors = {GEOSTYLER: self.txtGeostyler, SLD: self.txtSld,
+                         MAPBOX: self.txtMapbox, MAPSERVER: self.txtMapserver}
+        self._tabFormats = {self.tab: (GEOSTYLER,), self.tab_2: (SLD,), self.tab_3: (MAPBOX,),
+                            self.tab_5: (MAPSERVER,), self.tab_4: FORMATS}
+        self._cache = OrderedDict()
+        self._task = None
+        self._runningTasks = set()
+        self._pending = True
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(UPDATE_DELAY)
+        self._timer.timeout.connect(self._refresh)
+        self.tabWidget.currentChanged.connect(lambda _: self._refresh())
+        self.visibilityChanged.connect(self._visibilityChanged)
+
         self.updateForCurrentLayer()
 
     def updateLayer(self, layer):
@@ -47,30 +121,73 @@ class MultistylerWidget(BASE, WIDGET):
             self.updateForCurrentLayer()
 
     def updateForCurrentLayer(self):
-        layer = iface.activeLayer()        
-        sld = ""
-        geostyler = ""
-        mapbox = ""
-        mapserver = ""
-        warnings = []
-        if layer is not None:
-            if (isinstance(layer, QgsRasterLayer) or
-                    (isinstance(layer, QgsVectorLayer) and layer.isSpatial())):
-                sld, _, sld_warnings = layerStyleAsSld(layer)
-                geostyler, icons, sprites, geostyler_warnings = convert(layer)
-                geostyler = json.dumps(geostyler, indent=4)
-                mapbox, _, mapbox_warnings = layerStyleAsMapbox(layer)
-                mapserver, _, _, mapserverWarnings = layerStyleAsMapfile(layer)
-                warnings = set()
-                warnings.update(sld_warnings)
-                warnings.update(geostyler_warnings)
-                warnings.update(mapbox_warnings)
-                warnings.update(mapserverWarnings)
-        self.txtSld.setText(sld)
-        self.txtGeostyler.setText(geostyler)
-        self.txtMapbox.setText(mapbox)
-        self.txtMapserver.setText(mapserver)
-        self.txtWarnings.setPlainText("\n".join(warnings))
+        """ Schedules a (debounced) update. Updates are postponed while the dock widget is hidden. """
+        if not self.isVisible():
+            self._pending = True
+            return
+        self._timer.start()
+
+    def _visibilityChanged(self, visible):
+        if visible and self._pending:
+            self._timer.start()
+
+    def _refresh(self):
+        """ Shows the converted styles for the current tab, starting a background conversion if needed. """
+        self._pending = False
+        layer = iface.activeLayer()
+        if layer is None or not (isinstance(layer, QgsRasterLayer) or
+                                 (isinstance(layer, QgsVectorLayer) and layer.isSpatial())):
+            self._cancelTask()
+            self._showResults({})
+            return
+        key = layer.id(), styleRevision(layer)
+        results = self._cache.setdefault(key, {})
+        self._cache.move_to_end(key)
+        while len(self._cache) > MAX_CACHED_STYLES:
+            self._cache.popitem(last=False)
+        self._showResults(results)
+
+        missing = [f for f in self._tabFormats.get(self.tabWidget.currentWidget(), ()) if f not in results]
+        if not missing:
+            return
+        if self._task is not None and self._task.key == key and set(missing).issubset(self._task.formats):
+            # The conversion is already running
+            return
+        self._cancelTask()
+        task = StyleConversionTask(layer, missing, key)
+        task.taskCompleted.connect(partial(self._conversionFinished, task))
+        task.taskTerminated.connect(partial(self._runningTasks.discard, task))
+        # Keep a reference to every running task (also canceled ones), so that they are not garbage collected
+        self._runningTasks.add(task)
+        self._task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def _cancelTask(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _conversionFinished(self, task):
+        self._runningTasks.discard(task)
+        if task is self._task:
+            self._task = None
+        results = self._cache.get(task.key)
+        if results is None:
+            return
+        results.update(task.results)
+        layer = iface.activeLayer()
+        if layer is not None and self._cache and next(reversed(self._cache)) == task.key \
+                and layer.id() == task.key[0]:
+            self._showResults(results)
+
+    def _showResults(self, results):
+        warnings = set()
+        for fmt, editor in self._editors.items():
+            text, fmt_warnings = results.get(fmt, ("", []))
+            if editor.text() != text:
+                editor.setText(text)
+            warnings.update(fmt_warnings)
+        self.txtWarnings.setPlainText("\n".join(sorted(warnings)))
 
 
 class EditorWidget(QsciScintilla):
@@ -1,6 +1,7 @@
-from qgis.PyQt.QtCore import Qt, QCoreApplication
+from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtGui import QBrush, QIcon, QColor
 from qgis.PyQt.QtWidgets import QTreeWidgetItem
+from qgis.core import QgsTask
 
 from geocatbridge.utils import files, gui
 
@@ -21,8 +22,40 @@ class ProgressDialog(BASE, WIDGET):
         super(ProgressDialog, self).__init__(parent)
         self.setupUi(self)
         self.layers = layers
+        self._items = {}
+        self._groupsItem = None
+        self._task = None
+        self.buttonBox.rejected.connect(self.reject)
         self.populateTree()
 
+    def setTask(self, task):
+        """
+        Shows the progress of the given (publish or export) task, which runs in the background.
+        Its step signals are queued to the GUI thread. The dialog closes itself when the task ends.
+        This must be called before the task is added to the task manager.
+        """
+        self._task = task
+        task.stepStarted.connect(self.setInProgress)
+        task.stepSkipped.connect(self.setSkipped)
+        task.stepFinished.connect(self.setFinished)
+        task.progressChanged.connect(lambda value: self.progressBar.setValue(int(value)))
+        # Connected before the task manager connects to it, so the dialog is closed before the task reports results
+        task.statusChanged.connect(self._taskStatusChanged)
+
+    def _taskStatusChanged(self, status):
+        if status in (QgsTask.Complete, QgsTask.Terminated):
+            self._task = None
+            self.accept()
+
+    def reject(self):
+        # Closing the dialog while the task is running cancels the task: the dialog closes when it has stopped
+        if self._task is not None:
+            self.buttonBox.setEnabled(False)
+            self.setWindowTitle(self.tr("Canceling..."))
+            self._task.cancel()
+        else:
+            super().reject()
+
     def populateTree(self):
         for layer in self.layers:
             item = QTreeWidgetItem()
@@ -41,19 +74,20 @@ class ProgressDialog(BASE, WIDGET):
             item.addChild(subitem)            
             self.treeWidget.addTopLevelItem(item)
             item.setExpanded(False)
+            # Keep the first item for each layer name (like list.index() would find it)
+            self._items.setdefault(layer, item)
         item = QTreeWidgetItem()
         item.setText(0, "Create layer groups")
         item.setIcon(0, GROUPS_ICON)
         self.treeWidget.addTopLevelItem(item)
-        QCoreApplication.processEvents()
+        self._groupsItem = item
 
     def setFinished(self, layer, category):
         item = None
         if category == GROUPS:
-            subitem = self.treeWidget.topLevelItem(len(self.layers))
+            subitem = self._groupsItem
         else:
-            idx = self.layers.index(layer)
-            item = self.treeWidget.topLevelItem(idx)
+            item = self._items[layer]
             subitem = item.child(category)
         self.treeWidget.scrollToItem(subitem)
         green = QColor()
@@ -65,15 +99,13 @@ class ProgressDialog(BASE, WIDGET):
         if item and category == METADATA:
             item.setForeground(1, QBrush(Qt.blue))
             item.setIcon(1, CHECK_ICON)
-        QCoreApplication.processEvents()
 
     def setSkipped(self, layer, category):
         item = None
         if category == GROUPS:
-            subitem = self.treeWidget.topLevelItem(len(self.layers))
+            subitem = self._groupsItem
         else:
-            idx = self.layers.index(layer)
-            item = self.treeWidget.topLevelItem(idx)
+            item = self._items[layer]
             item.setExpanded(True)
             self.treeWidget.resizeColumnToContents(0)
             subitem = item.child(category)
@@ -83,14 +115,12 @@ class ProgressDialog(BASE, WIDGET):
         if item and category == METADATA:
             item.setForeground(1, QBrush(Qt.blue))
             item.setIcon(1, CHECK_ICON)
-        QCoreApplication.processEvents()
 
     def setInProgress(self, layer, category):
         if category == GROUPS:
-            subitem = self.treeWidget.topLevelItem(len(self.layers))
+            subitem = self._groupsItem
         else:
-            idx = self.layers.index(layer)
-            item = self.treeWidget.topLevelItem(idx)
+            item = self._items[layer]
             item.setExpanded(True)
             self.treeWidget.resizeColumnToContents(0)
             subitem = item.child(category)
@@ -100,4 +130,3 @@ class ProgressDialog(BASE, WIDGET):
         grey.setNamedColor("#cccccc")
         subitem.setBackground(0, QBrush(grey))
         subitem.setBackground(1, QBrush(grey))
-        QCoreApplication.processEvents()
@@ -1,4 +1,5 @@
 import os
+from functools import partial
 
 import requests
 from qgis.PyQt.QtCore import (
@@ -34,10 +35,10 @@ from qgis.utils import iface
 
 from geocatbridge.publish.geonetwork import GeonetworkServer
 from geocatbridge.publish.metadata import uuidForLayer, loadMetadataFromXml
-from geocatbridge.publish.publishtask import PublishTask, ExportTask
+from geocatbridge.publish.publishtask import PublishTask, ExportTask, PublicationStatusTask, layersByName
 from geocatbridge.publish.servers import geodataServers, metadataServers
 from geocatbridge.ui.metadatadialog import MetadataDialog
-from geocatbridge.ui.progressdialog import ProgressDialog
+from geocatbridge.ui.progressdialog import ProgressDialog, DATA, METADATA
 from geocatbridge.utils import files, gui
 from geocatbridge.utils.feedback import FeedbackMixin
 
@@ -65,6 +66,11 @@ class PublishWidget(FeedbackMixin, BASE, WIDGET):
 
         self.fieldsToPublish = {}
         self.metadata = {}
+        self._layerIndex = {}
+        self._connectionOk = {DATA: True, METADATA: True}
+        self._statusTasks = set()
+        self._publishTasks = set()
+        self._activeStatusTasks = {DATA: None, METADATA: None}
         gui.execute(self._setupUi)
 
     def _setupUi(self):
@@ -248,6 +254,7 @@ class PublishWidget(FeedbackMixin, BASE, WIDGET):
 
     def populateLayers(self):
         layers = self.publishableLayers()
+        self._layerIndex = layersByName(layers)
         for i, layer in enumerate(layers):
             fields = [f.name() for f in layer.fields()] if layer.type() == layer.VectorLayer else []
             self.fieldsToPublish[layer] = {f: True for f in fields}
@@ -397,50 +404,80 @@ class PublishWidget(FeedbackMixin, BASE, WIDGET):
                 widget.setDataPublished(server)
 
     def updateLayersPublicationStatus(self, data=True, metadata=True):
-        can_publish = True
+        """
+        Updates the data and/or metadata publication status icons of all layers.
+        The servers are probed by a background task: icons are updated as the results arrive.
+        """
         data_server = None
         metadata_server = None
 
         if data:
-            try:
-                data_server = geodataServers()[self.comboGeodataServer.currentText()]
-                if data_server.testConnection():
-                    self.comboGeodataServer.setStyleSheet("QComboBox { }")
-                else:
-                    self.comboGeodataServer.setStyleSheet("QComboBox { border: 2px solid red; }")
-                    can_publish = False
-            except KeyError:
-                self.comboGeodataServer.setStyleSheet("QComboBox { }")
-
+            self._cancelStatusTask(DATA)
+            data_server = geodataServers().get(self.comboGeodataServer.currentText())
+            self.comboGeodataServer.setStyleSheet("QComboBox { }")
+            self._connectionOk[DATA] = True
         if metadata:
-            try:
-                metadata_server = metadataServers()[self.comboMetadataServer.currentText()]
-                if metadata_server.testConnection():
-                    self.comboMetadataServer.setStyleSheet("QComboBox { }")
-                else:
-                    self.comboMetadataServer.setStyleSheet("QComboBox { border: 2px solid red; }")
-                    can_publish = False
-            except KeyError:
-                self.comboMetadataServer.setStyleSheet("QComboBox { }")
+            self._cancelStatusTask(METADATA)
+            metadata_server = metadataServers().get(self.comboMetadataServer.currentText())
+            self.comboMetadataServer.setStyleSheet("QComboBox { }")
+            self._connectionOk[METADATA] = True
 
+        layer_uuids = {}
         for i in range(self.listLayers.count()):
             item = self.listLayers.item(i)
             widget = self.listLayers.itemWidget(item)
             name = widget.name()
+            layer_uuids[name] = uuidForLayer(widget.layer)
             if data:
-                server = None
-                if data_server:
-                    self.isDataPublished[name] = self.isDataOnServer(name)
-                    server = data_server if self.isDataPublished[name] else None
-                widget.setDataPublished(server)
+                self.isDataPublished[name] = False
+                widget.setDataPublished(None)
             if metadata:
-                server = None
-                if metadata_server:
-                    self.isMetadataPublished[name] = self.isMetadataOnServer(name)
-                    server = metadata_server if self.isMetadataPublished[name] else None
-                widget.setMetadataPublished(server)
+                self.isMetadataPublished[name] = False
+                widget.setMetadataPublished(None)
+        self._updatePublishButtons()
+
+        if data_server is None and metadata_server is None:
+            return
 
-        can_publish = can_publish and self.listLayers.count()
+        task = PublicationStatusTask(layer_uuids, data_server, metadata_server)
+        task.connectionTested.connect(partial(self._connectionTested, task))
+        if data_server is not None:
+            self._activeStatusTasks[DATA] = task
+            task.dataStatus.connect(partial(self._statusReceived, task, DATA))
+        if metadata_server is not None:
+            self._activeStatusTasks[METADATA] = task
+            task.metadataStatus.connect(partial(self._statusReceived, task, METADATA))
+        # Keep a reference to the task, so it does not get garbage collected while running
+        self._statusTasks.add(task)
+        task.taskCompleted.connect(lambda: self._statusTasks.discard(task))
+        task.taskTerminated.connect(lambda: self._statusTasks.discard(task))
+        QgsApplication.taskManager().addTask(task)
+
+    def _cancelStatusTask(self, category):
+        task = self._activeStatusTasks.get(category)
+        self._activeStatusTasks[category] = None
+        if task is not None and task not in self._activeStatusTasks.values():
+            task.cancel()
+
+    def _statusReceived(self, task, category, name, value):
+        if self._activeStatusTasks.get(category) is not task:
+            # Result of an outdated status check (e.g. the selected server has changed)
+            return
+        if category == DATA:
+            self.updateLayerIsDataPublished(name, value)
+        else:
+            self.updateLayerIsMetadataPublished(name, value)
+
+    def _connectionTested(self, task, category, success):
+        if self._activeStatusTasks.get(category) is not task:
+            return
+        combo = self.comboGeodataServer if category == DATA else self.comboMetadataServer
+        combo.setStyleSheet("QComboBox { }" if success else "QComboBox { border: 2px solid red; }")
+        self._connectionOk[category] = success
+        self._updatePublishButtons()
+
+    def _updatePublishButtons(self):
+        can_publish = all(self._connectionOk.values()) and bool(self.listLayers.count())
         self.btnPublish.setEnabled(can_publish)
         self.btnPublishOnBackground.setEnabled(can_publish)
 
@@ -492,17 +529,22 @@ class PublishWidget(FeedbackMixin, BASE, WIDGET):
         if not self.validateBeforePublication(to_publish):
             return
 
+        # The task runs in the background: the progress dialog is updated through queued signals
         progress_dialog = ProgressDialog(to_publish, self.parent)
+        progress_dialog.setWindowModality(Qt.WindowModal)
         task = self.getPublishTask(self.parent)
-        task.stepStarted.connect(progress_dialog.setInProgress)
-        task.stepSkipped.connect(progress_dialog.setSkipped)
-        task.stepFinished.connect(progress_dialog.setFinished)
+        progress_dialog.setTask(task)
+        # Keep a reference to the task, so it does not get garbage collected while running
+        self._publishTasks.add(task)
+        task.taskCompleted.connect(partial(self._publishFinished, task))
+        task.taskTerminated.connect(partial(self._publishFinished, task))
         progress_dialog.show()
-        ret = gui.execute(task.run)
-        progress_dialog.close()
-        task.finished(ret)
+        QgsApplication.taskManager().addTask(task)
+
+    def _publishFinished(self, task):
+        self._publishTasks.discard(task)
         if task.exception is not None:
-            if task.exc_type == requests.exceptions.ConnectionError:
+            if getattr(task, "exc_type", None) == requests.exceptions.ConnectionError:
                 self.showErrorBox("Error while publishing",
                                   "Connection error. Server unavailable.\nSee QGIS log for details",
                                   propagate=task.exception)
@@ -545,7 +587,8 @@ class PublishWidget(FeedbackMixin, BASE, WIDGET):
         if self.comboGeodataServer.currentIndex() != 0:
             geodata_server = geodataServers()[self.comboGeodataServer.currentText()]
             geodata_server.validateGeodataBeforePublication(
-              errors, to_publish, self.chkOnlySymbology.checkState() == Qt.Checked
+              errors, to_publish, self.chkOnlySymbology.checkState() == Qt.Checked,
+              self.chkIncremental.checkState() == Qt.Checked
             )
 
         if self.comboMetadataServer.currentIndex() != 0:
@@ -589,18 +632,22 @@ class PublishWidget(FeedbackMixin, BASE, WIDGET):
                 metadata_server = None
 
             style_only = self.chkOnlySymbology.checkState() == Qt.Checked
+            incremental = self.chkIncremental.checkState() == Qt.Checked
 
-            return PublishTask(to_publish, self.fieldsToPublish, style_only, geodata_server, metadata_server, parent)
+            return PublishTask(to_publish, self.fieldsToPublish, style_only, geodata_server, metadata_server, parent,
+                               incremental)
         else:
             return ExportTask(self.txtExportFolder.text(), to_publish, self.fieldsToPublish,
                               self.chkExportData.isChecked(),
                               self.chkExportMetadata.isChecked(), self.chkExportSymbology.isChecked())
 
     def layerFromName(self, name):
-        layers = self.publishableLayers()
-        for layer in layers:
-            if layer.name() == name:
-                return layer
+        layer = self._layerIndex.get(name)
+        if layer is None:
+            # The project may have changed since the layer list was populated
+            self._layerIndex = layersByName(self.publishableLayers())
+            layer = self._layerIndex.get(name)
+        return layer
 
 
 class LayerItemWidget(QWidget):
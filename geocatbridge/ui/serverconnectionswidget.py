@@ -1,3 +1,6 @@
+from functools import partial
+
+from qgis.PyQt.QtCore import pyqtSignal
 from qgis.PyQt.QtGui import QPixmap
 from qgis.PyQt.QtWidgets import (
     QHBoxLayout,
@@ -7,8 +10,10 @@ from qgis.PyQt.QtWidgets import (
     QWidget,
     QFileDialog
 )
+from qgis.core import QgsApplication, QgsTask
 from qgis.gui import QgsFileWidget, QgsAuthConfigSelect
 
+from geocatbridge.publish.datastorecatalog import catalogKey, cachedPostgisDatastores, storePostgisDatastores
 from geocatbridge.publish.geonetwork import GeonetworkServer
 from geocatbridge.publish.geoserver import GeoserverServer
 from geocatbridge.publish.mapserver import MapserverServer
@@ -21,12 +26,39 @@ from geocatbridge.utils.feedback import FeedbackMixin
 WIDGET, BASE = gui.loadUiType(__file__)
 
 
+class PostgisDatastoresTask(QgsTask):
+    """
+    Searches all PostGIS datastores on a GeoServer in the background.
+    Datastores are emitted as soon as they are found. The complete list is stored in the datastore catalog cache.
+    """
+    datastoreFound = pyqtSignal(str)
+
+    def __init__(self, server):
+        super().__init__("Find PostGIS datastores in GeoCat Bridge", QgsTask.CanCancel)
+        self.server = server
+        self.datastores = []
+        self.exception = None
+
+    def run(self):
+        try:
+            self.datastores = self.server.postgisDatastores(self.datastoreFound.emit, self.isCanceled)
+            if self.isCanceled():
+                return False
+            storePostgisDatastores(catalogKey(self.server), self.datastores)
+            return True
+        except Exception as e:
+            self.exception = e
+            return False
+
+
 class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
 
     def __init__(self):
         super().__init__()
         self.currentServer = None
         self.currentServerHasChanges = False
+        self._datastoresTask = None
+        self._wantedDatastore = None
         self.setupUi(self)
 
         self.cswAuth = QgsAuthConfigSelect()
@@ -46,7 +78,7 @@ class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
         self.btnConnectPostgis.clicked.connect(self.testConnectionPostgis)
         self.btnConnectCsw.clicked.connect(self.testConnectionCsw)
         self.btnAddDatastore.clicked.connect(self.addPostgisDatastore)
-        self.btnRefreshDatabases.clicked.connect(self.populatePostgisComboWithGeoserverPostgisServers)
+        self.btnRefreshDatabases.clicked.connect(lambda: self.populatePostgisComboWithGeoserverPostgisServers(True))
 
         self.txtCswName.textChanged.connect(self._setCurrentServerHasChanges)
         self.txtCswNode.textChanged.connect(self._setCurrentServerHasChanges)
@@ -60,6 +92,7 @@ class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
         self.txtPostgisDatabase.textChanged.connect(self._setCurrentServerHasChanges)
         self.comboMetadataProfile.currentIndexChanged.connect(self._setCurrentServerHasChanges)
         self.comboGeoserverDatabase.currentIndexChanged.connect(self._setCurrentServerHasChanges)
+        self.comboGeoserverDatabase.activated.connect(self._datastoreChosen)
 
         self.radioLocalPath.toggled.connect(self.mapserverStorageChanged)
 
@@ -117,6 +150,8 @@ class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
             self.btnAddDatastore.setVisible(False)
             self.labelGeoserverDatastore.setVisible(False)
             self.btnRefreshDatabases.setVisible(False)
+        # Layers can only share a datastore when their data is uploaded as files
+        self.chkSingleDatastore.setVisible(storage == GeoserverServer.FILE_BASED)
         self._setCurrentServerHasChanges()
 
     def addPostgisDatastore(self):
@@ -153,7 +188,8 @@ class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
         }
         try:
             gui.execute(lambda: server.addPostgisDatastore(ds))
-            self.populatePostgisComboWithGeoserverPostgisServers()
+            self._wantedDatastore = f"{server.workspace}:{dlg.name}"
+            self.populatePostgisComboWithGeoserverPostgisServers(True)
         except Exception as e:
             self.showErrorBar("Error", "Could not create new PostGIS dataset", propagate=e)
 
@@ -259,14 +295,22 @@ class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
         postgisdb = None
         if storage in [GeoserverServer.POSTGIS_MANAGED_BY_BRIDGE, GeoserverServer.POSTGIS_MANAGED_BY_GEOSERVER]:
             postgisdb = self.comboGeoserverDatabase.currentText()
+            if self._datastoresTask is not None and self._wantedDatastore:
+                # The configured datastore has not been found (yet): do not replace it with another one
+                postgisdb = self._wantedDatastore
         use_original_data_source = self.chkUseOriginalDataSource.isChecked()
         use_vector_tiles = self.chkUseVectorTiles.isChecked()
+        single_datastore = self.chkSingleDatastore.isChecked()
 
         if "" in [name, url]:
             return None
+        # Path mappings are not edited in this widget: keep the ones of the server that is being edited
+        path_mappings = None
+        if isinstance(self.currentServer, GeoserverServer):
+            path_mappings = self.currentServer.pathMappings
         server = GeoserverServer(
             name, url, authid, storage, postgisdb, use_original_data_source,
-            use_vector_tiles
+            use_vector_tiles, path_mappings, single_datastore
         )
         return server
 
@@ -385,26 +429,79 @@ class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
             self.listServers.setCurrentItem(item)
 
     def populatePostgisComboWithPostgisServers(self):
+        self._cancelDatastoresTask()
+        self._wantedDatastore = None
         self.comboGeoserverDatabase.clear()
         servers = allServers().values()
         for s in servers:
             if isinstance(s, PostgisServer):
                 self.comboGeoserverDatabase.addItem(s.name)
 
-    def populatePostgisComboWithGeoserverPostgisServers(self):
-        self.comboGeoserverDatabase.clear()
+    def populatePostgisComboWithGeoserverPostgisServers(self, refresh=False):
+        """
+        Fills the database combo box with the PostGIS datastores of the GeoServer that is being edited.
+        The datastores are taken from the catalog cache, unless the cache expired or `refresh` is True:
+        in that case, they are searched in the background and added to the combo box as soon as they are found.
+        """
+        self._cancelDatastoresTask()
+        wanted = self._wantedDatastore or self.comboGeoserverDatabase.currentText()
         server = self.createGeoserverServer()
+        # Filling the combo box is not a change made by the user
+        self.comboGeoserverDatabase.blockSignals(True)
+        self.comboGeoserverDatabase.clear()
+        self.comboGeoserverDatabase.blockSignals(False)
         if server is None:
             self.showErrorBar("Error", "Wrong values in server definition")
             return
-        try:
-            datastores = gui.execute(server.postgisDatastores)
-        except Exception as e:
-            self.logWarning(e)
-            datastores = []
-        if datastores:
+        datastores = None if refresh else cachedPostgisDatastores(catalogKey(server))
+        if datastores is not None:
+            self._wantedDatastore = None
+            self.comboGeoserverDatabase.blockSignals(True)
             self.comboGeoserverDatabase.addItems(datastores)
-        else:
+            if wanted:
+                self.comboGeoserverDatabase.setCurrentText(wanted)
+            self.comboGeoserverDatabase.blockSignals(False)
+            if not datastores:
+                self.showWarningBar("Warning", "No PostGIS datastores in server or could not retrieve them")
+            return
+        self._wantedDatastore = wanted
+        task = PostgisDatastoresTask(server)
+        task.datastoreFound.connect(partial(self._datastoreFound, task))
+        task.taskCompleted.connect(partial(self._datastoresFinished, task))
+        task.taskTerminated.connect(partial(self._datastoresFinished, task))
+        self._datastoresTask = task
+        self.btnRefreshDatabases.setEnabled(False)
+        QgsApplication.taskManager().addTask(task)
+
+    def _cancelDatastoresTask(self):
+        task, self._datastoresTask = self._datastoresTask, None
+        self.btnRefreshDatabases.setEnabled(True)
+        if task is not None:
+            task.cancel()
+
+    def _datastoreFound(self, task, name):
+        if task is not self._datastoresTask:
+            # Result of an outdated search (e.g. another server is being edited now)
+            return
+        self.comboGeoserverDatabase.blockSignals(True)
+        self.comboGeoserverDatabase.addItem(name)
+        if name == self._wantedDatastore:
+            self.comboGeoserverDatabase.setCurrentText(name)
+        self.comboGeoserverDatabase.blockSignals(False)
+
+    def _datastoreChosen(self):
+        # The user picked a datastore: stop waiting for the configured one
+        self._wantedDatastore = None
+
+    def _datastoresFinished(self, task):
+        if task is not self._datastoresTask:
+            return
+        self._datastoresTask = None
+        self._wantedDatastore = None
+        self.btnRefreshDatabases.setEnabled(True)
+        if task.exception is not None:
+            self.logWarning(task.exception)
+        if not task.datastores:
             self.showWarningBar("Warning", "No PostGIS datastores in server or could not retrieve them")
 
     def _setCurrentServerHasChanges(self):
@@ -421,11 +518,14 @@ class ServerConnectionsWidget(FeedbackMixin, BASE, WIDGET):
             self.geoserverAuth.setConfigId(server.authid)
             self.comboGeoserverDataStorage.blockSignals(True)
             self.comboGeoserverDataStorage.setCurrentIndex(server.storage)
+            # The datastores may be loaded in the background: select the configured one when it is found
+            self._wantedDatastore = server.postgisdb
             self.geoserverDatastorageChanged()
             if server.postgisdb is not None:
                 self.comboGeoserverDatabase.setCurrentText(server.postgisdb)
             self.chkUseOriginalDataSource.setChecked(server.useOriginalDataSource)
             self.chkUseVectorTiles.setChecked(server.useVectorTiles)
+            self.chkSingleDatastore.setChecked(server.singleDatastore)
             self.comboGeoserverDataStorage.blockSignals(False)
         elif isinstance(server, MapserverServer):
             self.stackedWidget.setCurrentWidget(self.widgetMapserver)
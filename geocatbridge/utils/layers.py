@@ -16,6 +16,29 @@ def getLayerSourceInfo(layer):
     return filepath, name, ext
 
 
+def getLayerSourceStats(layer):
+    """
+    Returns a list of (file name, size, modification time) for the layer source file and all its sidecar files
+    (e.g. .dbf, .shx and .prj for Shapefiles or -wal for GeoPackages).
+    Returns None if the layer has unsaved edits or is not stored in a local file,
+    because changes to the layer data cannot be detected from the file system then.
+    """
+    # Only vector layers have an edit buffer (QgsMapLayer.isModified does not exist in older QGIS versions)
+    if layer.type() == layer.VectorLayer and layer.isModified():
+        return None
+    filepath, _, _ = getLayerSourceInfo(layer)
+    if not os.path.isfile(filepath):
+        return None
+    folder, name = os.path.split(filepath)
+    stem = os.path.splitext(name)[0]
+    stats = []
+    for filename in sorted(os.listdir(folder or ".")):
+        if filename == name or filename.startswith(stem + ".") or filename.startswith(name + "-"):
+            st = os.stat(os.path.join(folder, filename))
+            stats.append((filename, st.st_size, st.st_mtime_ns))
+    return stats
+
+
 def hasValidLayerName(layer):
     """
     Checks if there are some problematic characters in the layer name. Returns True when layer name is OK.
@@ -4,6 +4,9 @@ from pathlib import Path
 #: GeoCat Bridge plugin namespace
 PLUGIN_NAMESPACE = "geocatbridge"
 
+#: Maximum number of worker threads that publish (and export) layers simultaneously
+PUBLISH_WORKERS = 4
+
 _prop_cache = {}
 _meta_parser = configparser.ConfigParser()
 
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import zipfile
+from collections import OrderedDict
+from threading import RLock
+
+from qgis.PyQt.QtXml import QDomDocument
+
+from bridgestyle.mapboxgl import fromgeostyler as mapboxFromGeostyler
+from bridgestyle.mapserver import fromgeostyler as mapserverFromGeostyler
+from bridgestyle.qgis import togeostyler
+from bridgestyle.sld import fromgeostyler as sldFromGeostyler
+
+#: Maximum number of layer style revisions that are kept in the conversion cache
+MAX_CACHED_STYLES = 100
+
+_cache = OrderedDict()
+_lock = RLock()
+# The bridgestyle converters keep module-level state (e.g. used icons and warnings) that they reset on each call:
+# conversions must not run simultaneously (e.g. in publication workers and the style conversion task)
+_convertLock = RLock()
+
+
+def styleRevision(layer):
+    """ Returns a hash of the current layer style (QML), which changes whenever the style is modified. """
+    doc = QDomDocument()
+    layer.exportNamedStyle(doc)
+    return hashlib.sha1(doc.toByteArray().data()).hexdigest()
+
+
+def _entry(layer, layer_id=None):
+    """
+    Returns the cache entry for the current style of the given layer, converting the style to GeoStyler if needed.
+    The GeoStyler conversion is the expensive part: all other formats are derived from it.
+
+    :param layer:       The layer (or a clone of the layer) to convert.
+    :param layer_id:    The ID of the original layer, if `layer` is a clone.
+    """
+    key = layer_id or layer.id(), styleRevision(layer)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            return entry
+    # Convert outside the cache lock: cache lookups for other layers (in other threads) should not have to wait
+    with _convertLock:
+        geostyler, icons, sprites, warnings = togeostyler.convert(layer)
+        icons, warnings = list(icons), list(warnings)
+    entry = {"geostyler": (geostyler, icons, sprites, warnings)}
+    with _lock:
+        entry = _cache.setdefault(key, entry)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED_STYLES:
+            _cache.popitem(last=False)
+    return entry
+
+
+def _derived(layer, fmt, name, layer_id, converter):
+    """ Returns the (cached) output of `converter(geostyler)` for the style of the layer with the given name. """
+    entry = _entry(layer, layer_id)
+    geostyler, icons, _, warnings = entry["geostyler"]
+    name = name or geostyler.get("name")
+    key = fmt, name
+    with _lock:
+        result = entry.get(key)
+    if result is None:
+        with _convertLock:
+            *output, fmt_warnings = converter(dict(geostyler, name=name))
+            fmt_warnings = list(fmt_warnings)
+        result = entry[key] = tuple(output), warnings + fmt_warnings
+    output, all_warnings = result
+    return output, icons, list(all_warnings)
+
+
+def layerStyleAsGeostyler(layer, layer_id=None):
+    """ Returns a (geostyler, icons, sprites, warnings) tuple for the layer style. """
+    geostyler, icons, sprites, warnings = _entry(layer, layer_id)["geostyler"]
+    return geostyler, icons, sprites, list(warnings)
+
+
+def layerStyleAsSld(layer, name=None, layer_id=None):
+    """
+    Returns a (sld, icons, warnings) tuple for the layer style.
+    If `name` is set, it is used as the style name (instead of the layer name).
+    """
+    (sld,), icons, warnings = _derived(layer, "sld", name, layer_id, sldFromGeostyler.convert)
+    return sld, icons, warnings
+
+
+def layerStyleAsMapbox(layer, name=None, layer_id=None):
+    """ Returns a (mapbox, icons, warnings) tuple for the layer style. """
+    (mapbox,), icons, warnings = _derived(layer, "mapbox", name, layer_id, mapboxFromGeostyler.convert)
+    return mapbox, icons, warnings
+
+
+def layerStyleAsMapfile(layer, name=None, layer_id=None):
+    """ Returns a (mapfile, symbols, icons, warnings) tuple for the layer style. """
+    (mapfile, symbols), icons, warnings = _derived(layer, "mapfile", name, layer_id, mapserverFromGeostyler.convert)
+    return mapfile, symbols, icons, warnings
+
+
+def saveLayerStyleAsZippedSld(layer, filename, name=None):
+    """
+    Writes the layer style as SLD (and all icons that it uses) to a ZIP file and returns the conversion warnings.
+    The SLD file is named after `name` (or the layer name if not set).
+    """
+    name = name or layer.name()
+    sld, icons, warnings = layerStyleAsSld(layer, name)
+    with zipfile.ZipFile(filename, "w") as z:
+        for icon in icons:
+            if icon and os.path.exists(icon):
+                z.write(icon, os.path.basename(icon))
+        z.writestr(name + ".sld", sld)
+    return warnings
+
+
+def clearStyleCache():
+    """ Removes all cached style conversions. """
+    with _lock:
+        _cache.clear()